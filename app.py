@@ -1,32 +1,42 @@
-from gevent import monkey
-monkey.patch_all()
-
-from flask import Flask
-from flask_socketio import SocketIO
-from config import Config
-from core.database import init_databases, alter_max_prices,create_indexes
-from core.processing import start_processing_worker
-from utils import init_utils
-from routes import main, admin, max_prices
-
-# Initialize app
-
-app = Flask(__name__)
-app.secret_key = Config.SECRET_KEY
-
-# Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="gevent")
-init_utils(socketio)
-
-# Register blueprints
-app.register_blueprint(main.bp)
-app.register_blueprint(admin.bp)
-app.register_blueprint(max_prices.bp)
-
-init_databases()
-alter_max_prices()
-create_indexes()
-
-
-# Start processing worker
-start_processing_worker()
+from gevent import monkey
+monkey.patch_all()
+
+from flask import Flask
+from flask_socketio import SocketIO
+from config import Config
+from core.database import init_databases, alter_max_prices, alter_ingest_jobs, create_indexes, create_deals_table
+from core.processing import start_processing_worker
+from core.jobs import recover_jobs
+from core.maintenance import start_maintenance
+from utils import init_utils
+from routes import main, admin, max_prices, api
+
+# Initialize app
+
+app = Flask(__name__)
+app.secret_key = Config.SECRET_KEY
+
+# Initialize SocketIO
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode="gevent")
+init_utils(socketio)
+
+# Register blueprints
+app.register_blueprint(main.bp)
+app.register_blueprint(admin.bp)
+app.register_blueprint(max_prices.bp)
+app.register_blueprint(api.bp)
+
+init_databases()
+alter_max_prices()
+alter_ingest_jobs()
+create_indexes()
+create_deals_table()
+
+# Resume jobs interrupted by the last shutdown from their checkpoints
+recover_jobs()
+
+# Start processing worker
+start_processing_worker()
+
+# Start scheduled maintenance (price history compaction)
+start_maintenance()
@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+
+def setup_environment(workdir=None):
+    """Point the app at throwaway databases under workdir.
+
+    Must run before config or any core module is imported, since they read
+    the database paths at import time. Returns the working directory.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["STORES_DB"] = os.path.join(workdir, "stores.db")
+    os.environ["UPCZIP_DB"] = os.path.join(workdir, "upczip.db")
+    return workdir
@@ -0,0 +1,154 @@
+"""Record EXPLAIN QUERY PLAN and timings of every search shape.
+
+Builds a synthetic database, runs each query shape from core.search and
+compares plans and median timings with a baseline JSON file:
+
+    python -m benchmarks.query_plans --scale small            # check
+    python -m benchmarks.query_plans --scale small --update   # re-record
+
+Exits non-zero when a plan changes or a shape gets slower than the
+baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from benchmarks import setup_environment
+from benchmarks.synthetic import add_dataset_arguments, build_databases, dataset_overrides, zip_for
+
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Absolute slack so sub-millisecond shapes don't fail on timer noise
+NOISE_FLOOR_MS = 2.0
+
+
+def search_shapes(cursor):
+    """Return (name, build_search_query kwargs) for each search the app issues"""
+    # Pick a deal that exists so every shape returns rows
+    cursor.execute("""
+        SELECT i.upc, s.motherZip, s.state, s.city
+        FROM deals d JOIN items i ON i.id = d.item_id JOIN stores s ON s.id = d.store_id
+        ORDER BY d.store_id, d.item_id LIMIT 1
+    """)
+    upc, mother_zip, state, city = cursor.fetchone()
+    return [
+        ("upc", {"upc": upc}),
+        ("zip", {"motherzipcode": mother_zip}),
+        ("upc_zip", {"upc": upc, "motherzipcode": mother_zip}),
+        ("state", {"state": state}),
+        ("state_city", {"state": state, "city": city}),
+        ("city", {"city": city}),
+        ("upc_state", {"upc": upc, "state": state}),
+        ("price", {"price": "2"}),
+        ("upc_price", {"upc": upc, "price": "50"}),
+        ("zip_price", {"motherzipcode": mother_zip, "price": "5"}),
+        ("upc_in_stock", {"upc": upc, "remove_zero_inventory": True}),
+        ("zip_in_stock", {"motherzipcode": mother_zip, "remove_zero_inventory": True}),
+        ("deals_upc", {"upc": upc, "deal_filter": True}),
+        ("deals_zip", {"motherzipcode": mother_zip, "deal_filter": True}),
+        ("deals_state", {"state": state, "deal_filter": True}),
+        ("bulk_zip", {"zip_table": "search_zipcodes"}),
+        ("bulk_zip_upc", {"zip_table": "search_zipcodes", "upc": upc}),
+        ("bulk_deals", {"zip_table": "search_zipcodes", "deal_filter": True}),
+    ]
+
+
+def load_bulk_zipcodes(cursor, count=200):
+    """Fill the bulk search temp table the way iter_bulk_search_by_zipcodes does"""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS search_zipcodes (zip TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM search_zipcodes")
+    cursor.executemany("INSERT OR IGNORE INTO search_zipcodes (zip) VALUES (?)", ((zip_for(i * 3),) for i in range(count)))
+
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+    return [row[3] for row in cursor.fetchall()]
+
+
+def time_query(cursor, query, params, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        rows = len(cursor.fetchall())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def record(repeat=5):
+    """Return plans and timings for every search shape"""
+    from config import Config
+    from core.database import get_db_connection
+    from core.search import build_search_query
+
+    results = {}
+    with get_db_connection(Config.DATABASE) as conn:
+        cursor = conn.cursor()
+        load_bulk_zipcodes(cursor)
+        for name, kwargs in search_shapes(cursor):
+            query, params = build_search_query(**kwargs)
+            median_ms, rows = time_query(cursor, query, params, repeat)
+            results[name] = {
+                "plan": explain(cursor, query, params),
+                "median_ms": round(median_ms, 3),
+                "rows": rows,
+            }
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Return a list of regressions of current against baseline"""
+    problems = []
+    for name, result in current.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["plan"] != expected["plan"]:
+            problems.append(f"{name}: plan changed\n    was: {expected['plan']}\n    now: {result['plan']}")
+        limit = max(expected["median_ms"] * (1 + tolerance), expected["median_ms"] + NOISE_FLOOR_MS)
+        if result["median_ms"] > limit:
+            problems.append(f"{name}: {result['median_ms']:.2f} ms, baseline {expected['median_ms']:.2f} ms")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_dataset_arguments(parser)
+    parser.add_argument("--baseline", help="baseline JSON (default: baselines/query_plans_<scale>.json)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 = 50%%")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    setup_environment(args.workdir)
+    print(f"Building {args.scale} dataset: {build_databases(args.scale, args.seed, **dataset_overrides(args))}")
+    current = record(args.repeat)
+    for name, result in current.items():
+        print(f"{name:14} {result['median_ms']:9.2f} ms {result['rows']:8} rows  {' | '.join(result['plan'])}")
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"query_plans_{args.scale}.json")
+    if args.update:
+        with open(baseline_path, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {baseline_path}")
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}; run with --update to record one")
+        return 0
+    with open(baseline_path) as f:
+        problems = compare(current, json.load(f), args.tolerance)
+    for problem in problems:
+        print("REGRESSION " + problem)
+    print("OK" if not problems else f"{len(problems)} regressions")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""End-to-end benchmark scenarios against a synthetic dataset.
+
+Builds the dataset, starts the stock API stub, imports the app the way
+gunicorn would and runs each scenario, reporting throughput, p50/p99
+latency and the process's peak RSS:
+
+    python -m benchmarks.scenarios --scale small
+    python -m benchmarks.scenarios --scale medium --scenarios ingest --rows 5000 --latency 0.2
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+import gevent
+
+from benchmarks import setup_environment
+from benchmarks.synthetic import (
+    SCALES, add_dataset_arguments, build_databases, dataset_overrides, store_location, upc_for, zip_for,
+    STORES_PER_ZIP,
+)
+from benchmarks.stub_api import start_stub
+
+
+SCENARIOS = ["search", "bulk_search", "ingest", "max_prices"]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and the peak over the process lifetime
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def summarize(name, latencies, operations, elapsed, unit="ops", **extra):
+    """Build one report line from per-operation latencies in seconds"""
+    result = {
+        "scenario": name,
+        "operations": operations,
+        "unit": unit,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(operations / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(extra)
+    return result
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def random_search(rng, spec):
+    """Return search_by_zip_upc kwargs of a random shape the search form can produce"""
+    store_id = rng.randint(1, spec["stores"])
+    state, city, mother_zip = store_location(store_id)
+    upc = upc_for(rng.randint(1, spec["items"]))
+    shape = rng.choice(["upc", "zip", "upc_zip", "state_city", "deals_zip", "upc_in_stock"])
+    return {
+        "upc": {"upc": upc},
+        "zip": {"motherzipcode": mother_zip},
+        "upc_zip": {"upc": upc, "motherzipcode": mother_zip},
+        "state_city": {"state": state, "city": city},
+        "deals_zip": {"motherzipcode": mother_zip, "deal_filter": True},
+        "upc_in_stock": {"upc": upc, "remove_zero_inventory": True},
+    }[shape]
+
+
+def run_search(args, spec, rng):
+    """Random searches from a cold cache, then a replay of the ones that fit in the cache"""
+    from config import Config
+    from core.cache import search_cache
+    from core.search import search_by_zip_upc
+
+    searches = [random_search(rng, spec) for _ in range(args.searches)]
+    search_cache.clear()
+    results = []
+    for name, batch in (("search", searches), ("search_cached", searches[-Config.SEARCH_CACHE_ENTRIES:])):
+        hits = search_cache.metrics()["hits"]
+        latencies = []
+        rows = 0
+        started = time.perf_counter()
+        for kwargs in batch:
+            elapsed, found = timed(search_by_zip_upc, **kwargs)
+            latencies.append(elapsed)
+            rows += len(found)
+        results.append(summarize(name, latencies, len(batch), time.perf_counter() - started, "searches",
+                                 rows=rows, cache_hits=search_cache.metrics()["hits"] - hits))
+    return results
+
+
+def run_bulk_search(args, spec, rng):
+    from core.search import bulk_search_by_zipcodes
+
+    zip_count = spec["stores"] // STORES_PER_ZIP + 1
+    latencies = []
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(args.bulk_runs):
+        zipcodes = [zip_for(rng.randrange(zip_count)) for _ in range(args.bulk_zips)]
+        elapsed, found = timed(bulk_search_by_zipcodes, zipcodes, deal_filter=rng.random() < 0.5)
+        latencies.append(elapsed)
+        rows += len(found)
+    return [summarize("bulk_search", latencies, args.bulk_runs, time.perf_counter() - started, "searches",
+                      zipcodes_per_search=args.bulk_zips, rows=rows)]
+
+
+def run_ingest(args, spec, rng):
+    """Push a CSV upload through the job queue and queue_worker like /upload_csv does"""
+    from config import Config
+    from core.jobs import create_job, get_job, job_queue
+    from core.processing import ingest_stats
+    from core.upstream import stock_client
+
+    path = os.path.join(os.path.dirname(Config.DATABASE), "ingest.csv")
+    zip_count = spec["stores"] // STORES_PER_ZIP + 1
+    with open(path, "w") as f:
+        f.write("upc,zip\n")
+        for _ in range(args.rows):
+            f.write(f"{upc_for(rng.randint(1, spec['items']))},{zip_for(rng.randrange(zip_count))}\n")
+
+    # Time each upstream lookup as the worker makes it
+    latencies = []
+    fetch = stock_client.fetch
+
+    def timed_fetch(upc, zip_code):
+        elapsed, result = timed(fetch, upc, zip_code)
+        latencies.append(elapsed)
+        return result
+
+    stock_client.fetch = timed_fetch
+    before = dict(ingest_stats)
+    try:
+        started = time.perf_counter()
+        job_id = create_job(path)
+        job_queue.put_csv(job_id)
+        while get_job(job_id)["status"] not in ("done", "failed"):
+            gevent.sleep(0.05)
+        elapsed = time.perf_counter() - started
+    finally:
+        stock_client.fetch = fetch
+
+    stats = {key: ingest_stats[key] - before[key] for key in ingest_stats}
+    return [summarize("ingest", latencies, args.rows, elapsed, "rows", status=get_job(job_id)["status"],
+                      api_latency=args.latency, **stats)]
+
+
+def run_max_prices(args, spec, rng):
+    """Upload a max-price sheet through the Flask route"""
+    import app as application
+
+    client = application.app.test_client()
+    lines = ["UPC,PRICE,DESCRIPTION,NET,DEPARTMENT,PRODUCTID"]
+    for index in range(args.max_price_rows):
+        item_id = rng.randint(1, spec["items"])
+        lines.append(f"{upc_for(item_id)},${rng.uniform(1, 100):.2f},Product {item_id},{rng.uniform(1, 50):.2f},GROCERY,P{item_id}")
+    sheet = ("\n".join(lines) + "\n").encode()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(args.max_price_runs):
+        elapsed, response = timed(
+            client.post, "/upload_max_prices", data={"file": (io.BytesIO(sheet), "max_prices.csv")},
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"max-price upload failed: {response.get_json()}")
+        latencies.append(elapsed)
+    elapsed = time.perf_counter() - started
+    return [summarize("max_prices", latencies, args.max_price_rows * args.max_price_runs, elapsed, "rows",
+                      uploads=args.max_price_runs)]
+
+
+RUNNERS = {
+    "search": run_search,
+    "bulk_search": run_bulk_search,
+    "ingest": run_ingest,
+    "max_prices": run_max_prices,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run end-to-end benchmark scenarios")
+    add_dataset_arguments(parser)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--bulk-runs", type=int, default=10)
+    parser.add_argument("--bulk-zips", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=2000, help="CSV rows for the ingest scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub API seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=1000, help="API_RATE_LIMIT during the run")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--max-price-rows", type=int, default=100000)
+    parser.add_argument("--max-price-runs", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="print app logs")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(RUNNERS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = setup_environment(args.workdir)
+    os.environ["API_URL"] = f"http://127.0.0.1:{args.port}/stock/store"
+
+    # Settings the app reads when its modules are first imported
+    from config import Config
+    Config.API_RATE_LIMIT = args.rate_limit
+    Config.API_RATE_BURST = args.rate_limit * 2
+    Config.UPLOAD_FOLDER = workdir
+    if not args.verbose:
+        Config.LOG_LEVEL = "error"
+
+    spec = dict(SCALES[args.scale], **{key: value for key, value in dataset_overrides(args).items() if value is not None})
+    counts = build_databases(args.scale, args.seed, **dataset_overrides(args))
+    print(f"Dataset in {workdir}: {json.dumps(counts)}")
+
+    server = start_stub(port=args.port, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    import app  # noqa: F401  starts the queue worker, batch writer and log flusher
+
+    rng = random.Random(args.seed)
+    results = []
+    try:
+        for name in scenarios:
+            for result in RUNNERS[name](args, spec, rng):
+                results.append(result)
+                print(
+                    f"{result['scenario']:14} {result['operations']:8} {result['unit']:8} "
+                    f"{result['throughput'] or 0:10.1f}/s  p50 {result['p50_ms']:9.2f} ms  "
+                    f"p99 {result['p99_ms']:9.2f} ms  peak RSS {result['peak_rss_mb']:7.1f} MB"
+                )
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"dataset": counts, "scale": args.scale, "results": results}, f, indent=2)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Local stand-in for the stock API with configurable latency.
+
+Answers the same POST body StockClient sends with stores that match the
+synthetic dataset (STORES_PER_ZIP stores per motherZip).
+
+    python -m benchmarks.stub_api --port 9099 --latency 0.05
+"""
+import argparse
+import json
+import random
+from gevent import monkey
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from benchmarks.synthetic import STORES_PER_ZIP, store_location
+
+
+def make_app(latency=0.05, jitter=0.0, error_rate=0.0, seed=None):
+    """Return a WSGI app answering stock lookups after latency (+/- jitter) seconds"""
+    rng = random.Random(seed)
+
+    def app(environ, start_response):
+        body = json.loads(environ["wsgi.input"].read() or b"{}")
+        gevent.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+        if rng.random() < error_rate:
+            start_response("503 Service Unavailable", [("Content-Type", "application/json")])
+            return [b'{"error": "unavailable"}']
+
+        upc = str(body.get("upc", ""))
+        zip_code = str(body.get("zip", ""))
+        zip_index = int(zip_code) - 10000 if zip_code.isdigit() else 0
+        stores = []
+        for store_id in range(zip_index * STORES_PER_ZIP, (zip_index + 1) * STORES_PER_ZIP):
+            state, city, mother_zip = store_location(store_id)
+            in_stock = rng.random() < 0.7
+            stores.append({
+                "id": str(store_id),
+                "address": f"{store_id} Main St",
+                "city": city,
+                "state": state,
+                "zip": mother_zip,
+                "storeUrl": f"https://example.com/store/{store_id}",
+                "price": round(rng.uniform(1, 100), 2),
+                "salesFloor": rng.randint(1, 20) if in_stock else 0,
+                "backRoom": rng.randint(0, 10) if in_stock else 0,
+                "aisles": "A1",
+            })
+        data = {
+            "itemDetails": {"name": f"Item {upc}", "msrp": 99.99, "imageUrl": "", "url": ""},
+            "stores": stores,
+        }
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [json.dumps(data).encode()]
+
+    return app
+
+
+def start_stub(host="127.0.0.1", port=9099, **options):
+    """Start the stub in a background greenlet and return the server; call stop() when done"""
+    server = WSGIServer((host, port), make_app(**options), log=None)
+    server.start()
+    return server
+
+
+def main(argv=None):
+    monkey.patch_all()
+    parser = argparse.ArgumentParser(description="Run a local stub of the stock API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds added to latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of responses that are HTTP 503")
+    args = parser.parse_args(argv)
+
+    server = WSGIServer((args.host, args.port), make_app(args.latency, args.jitter, args.error_rate), log=None)
+    print(f"Stock API stub listening on http://{args.host}:{args.port}/stock/store (latency {args.latency}s)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""Synthetic stores.db / upczip.db datasets for benchmarks.
+
+    python -m benchmarks.synthetic --scale medium --workdir /tmp/bench
+    python -m benchmarks.synthetic --stores 4500 --items 100000 --density 0.01
+
+The app modules read their database paths at import time, so they are
+imported inside the functions, after benchmarks.setup_environment has run.
+"""
+import argparse
+import random
+import time
+
+# stores x items, with the share of items each store carries and the share
+# of items that have a max price
+SCALES = {
+    "tiny": {"stores": 100, "items": 500, "density": 0.1, "max_price_share": 0.3},
+    "small": {"stores": 500, "items": 4000, "density": 0.05, "max_price_share": 0.3},
+    "medium": {"stores": 2000, "items": 20000, "density": 0.025, "max_price_share": 0.3},
+    "large": {"stores": 4500, "items": 60000, "density": 0.02, "max_price_share": 0.3},
+}
+
+STATES = ["TX", "CA", "FL", "NY", "PA", "IL", "OH", "GA", "NC", "MI"]
+CITIES_PER_STATE = 20
+STORES_PER_ZIP = 4
+DEPARTMENTS = ["GROCERY", "ELECTRONICS", "TOYS", "HOME", "PHARMACY", "APPAREL"]
+
+
+def upc_for(index):
+    return str(100000000000 + index)
+
+
+def zip_for(index):
+    return str(10000 + index)
+
+
+def store_location(store_id):
+    """Return (state, city, motherZip) of a synthetic store"""
+    state = STATES[store_id % len(STATES)]
+    city = f"{state} City {store_id // len(STATES) % CITIES_PER_STATE}"
+    return state, city, zip_for(store_id // STORES_PER_ZIP)
+
+
+def build_databases(scale="small", seed=42, batch_size=50000, **overrides):
+    """Create the app schema and fill it with a deterministic synthetic dataset.
+
+    overrides replace any of the scale's stores, items, density or
+    max_price_share settings.
+    """
+    from config import Config
+    from core.database import (
+        get_db_connection, init_databases, alter_max_prices, create_indexes, create_deals_table,
+    )
+
+    spec = dict(SCALES[scale], **{key: value for key, value in overrides.items() if value is not None})
+    rng = random.Random(seed)
+    now = int(time.time())
+    started = time.time()
+
+    init_databases()
+    alter_max_prices()
+    create_indexes()
+    create_deals_table()
+
+    with get_db_connection(Config.DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO stores (id, address, city, state, zipcode, motherZip, store_url) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (store_id, f"{store_id} Main St", city, state, mother_zip, mother_zip, f"https://example.com/store/{store_id}")
+                for store_id in range(1, spec["stores"] + 1)
+                for state, city, mother_zip in [store_location(store_id)]
+            ),
+        )
+        cursor.executemany(
+            "INSERT INTO items (id, name, upc, msrp, image_url, item_url) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (item_id, f"Item {item_id}", upc_for(item_id), round(rng.uniform(1, 200), 2), "", "")
+                for item_id in range(1, spec["items"] + 1)
+            ),
+        )
+
+        msrp = {item_id: price for item_id, price in cursor.execute("SELECT id, msrp FROM items")}
+        max_price_items = rng.sample(range(1, spec["items"] + 1), int(spec["items"] * spec["max_price_share"]))
+        cursor.executemany(
+            "INSERT INTO upc_max_prices (upc, max_price, description, net, department, productid) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (upc_for(item_id), round(msrp[item_id] * rng.uniform(0.3, 0.9), 2), f"Product {item_id}",
+                 round(msrp[item_id] * 0.5, 2), rng.choice(DEPARTMENTS), f"P{item_id}")
+                for item_id in max_price_items
+            ),
+        )
+
+        carried = max(1, int(spec["items"] * spec["density"]))
+        batch = []
+        for store_id in range(1, spec["stores"] + 1):
+            for item_id in rng.sample(range(1, spec["items"] + 1), carried):
+                in_stock = rng.random() < 0.7
+                batch.append((
+                    store_id, item_id, round(msrp[item_id] * rng.uniform(0.2, 1.1), 2),
+                    rng.randint(1, 20) if in_stock else 0, rng.randint(0, 10) if in_stock else 0, "A1",
+                ))
+            if len(batch) >= batch_size:
+                _insert_store_items(cursor, batch)
+                batch = []
+        _insert_store_items(cursor, batch)
+        cursor.execute("ANALYZE")
+        conn.commit()
+
+    with get_db_connection(Config.UPCZIP_DB) as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR IGNORE INTO upczip (upc, zip, timestamp) VALUES (?, ?, ?)",
+            (
+                (upc_for(rng.randint(1, spec["items"])), zip_for(rng.randint(0, spec["stores"] // STORES_PER_ZIP)),
+                 now - rng.randint(0, 60 * 24 * 60 * 60))
+                for _ in range(spec["items"] * 2)
+            ),
+        )
+        cursor.execute("ANALYZE")
+        conn.commit()
+
+    counts = table_counts()
+    counts["build_seconds"] = round(time.time() - started, 2)
+    return counts
+
+
+def _insert_store_items(cursor, rows):
+    # The deals triggers fire per row, just as they do for ingestion
+    cursor.executemany(
+        "INSERT INTO store_items (store_id, item_id, price, salesfloor, backroom, aisles) VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def table_counts():
+    """Return the row count of each benchmarked table"""
+    from config import Config
+    from core.database import get_db_connection
+
+    counts = {}
+    with get_db_connection(Config.DATABASE) as conn:
+        for table in ("stores", "items", "store_items", "upc_max_prices", "deals"):
+            counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    with get_db_connection(Config.UPCZIP_DB) as conn:
+        counts["upczip"] = conn.execute("SELECT COUNT(*) FROM upczip").fetchone()[0]
+    return counts
+
+
+def add_dataset_arguments(parser):
+    """Add the dataset size options shared by the benchmark commands"""
+    parser.add_argument("--scale", default="small", choices=sorted(SCALES))
+    parser.add_argument("--stores", type=int, help="override the scale's store count")
+    parser.add_argument("--items", type=int, help="override the scale's item count")
+    parser.add_argument("--density", type=float, help="share of items each store carries")
+    parser.add_argument("--max-price-share", type=float, help="share of items with a max price")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="directory for the databases (default: a temp dir)")
+
+
+def dataset_overrides(args):
+    return {
+        "stores": args.stores,
+        "items": args.items,
+        "density": args.density,
+        "max_price_share": args.max_price_share,
+    }
+
+
+def main(argv=None):
+    from benchmarks import setup_environment
+
+    parser = argparse.ArgumentParser(description="Generate synthetic stores.db and upczip.db datasets")
+    add_dataset_arguments(parser)
+    args = parser.parse_args(argv)
+
+    workdir = setup_environment(args.workdir)
+    counts = build_databases(args.scale, args.seed, **dataset_overrides(args))
+    print(f"Dataset written to {workdir}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,78 @@
-import os
-from collections import deque
-import threading
-from gevent.queue import Queue
-
-class Config:
-    SECRET_KEY = "admin"
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
-    UPCZIP_DB = "/database/upczip.db"
-    DATABASE = "/database/stores.db"
-    API_URL = "http://5.75.246.251:9099/stock/store"
-    MAX_LOGS = 10
-    MAX_RESULTS_IN_SESSION = 10
-    
-
-
-class qmanager:
-    
-    manual_queue = Queue()
-    csv_queue = Queue()
+import os
+from collections import deque
+import threading
+from gevent.queue import Queue
+
+class Config:
+    SECRET_KEY = "admin"
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+    UPCZIP_DB = os.environ.get("UPCZIP_DB", "/database/upczip.db")
+    DATABASE = os.environ.get("STORES_DB", "/database/stores.db")
+    API_URL = os.environ.get("API_URL", "http://5.75.246.251:9099/stock/store")
+    MAX_LOGS = 10
+    LOG_LEVEL = "info"                 # debug, info, warning or error
+    LOG_BUFFER_SIZE = 2000             # messages held between flushes before the oldest are dropped
+    LOG_FLUSH_INTERVAL = 0.25          # seconds between batched log emits
+    MAX_RESULTS_IN_SESSION = 10
+    INGEST_POOL_SIZE = 16              # concurrent upstream lookups while processing a CSV
+    API_MAX_CONNECTIONS_PER_HOST = 16  # keep-alive connections held open to API_URL
+    API_RATE_LIMIT = 25                # sustained requests per second to API_URL
+    API_RATE_BURST = 50                # requests allowed in a burst above the rate
+    API_CONNECT_TIMEOUT = 5            # seconds
+    API_READ_TIMEOUT = 30              # seconds
+    API_MAX_ATTEMPTS = 4               # tries per lookup before it is dead-lettered
+    API_BACKOFF_BASE = 0.5             # seconds, doubled on each retry (with jitter)
+    API_BACKOFF_MAX = 30               # seconds
+    API_BREAKER_THRESHOLD = 5          # consecutive failures that pause all lookups
+    API_BREAKER_RESET = 30             # seconds before a paused API is probed again
+    WRITE_BATCH_SIZE = 200             # API responses buffered before a batch write
+    WRITE_FLUSH_INTERVAL = 1.0         # seconds between time-triggered batch writes
+    WRITE_MAX_ATTEMPTS = 3             # failed writes of a batch before its responses are dead-lettered
+    JOB_CHECKPOINT_ROWS = 500          # rows between persisted CSV job cursors
+    JOB_LEASE_SECONDS = 60             # a running job is reclaimed this long after its last heartbeat
+    JOB_HEARTBEAT_INTERVAL = 10        # seconds between lease renewals by the owning worker
+    QUEUE_POLL_INTERVAL = 1.0          # seconds between checks for jobs queued by other processes
+    CSV_SLICE_ROWS = 1000              # rows a CSV job runs before other queued uploads get a turn
+    UPCZIP_FRESH_TTL = 6 * 60 * 60     # CSV rows skip pairs refreshed this recently (0 disables)
+    DB_POOL_SIZE = 32                  # max open connections per database file
+    DB_BUSY_TIMEOUT = 30               # seconds to wait on a locked database
+    DB_SYNCHRONOUS = "NORMAL"          # safe with WAL, far fewer fsyncs than FULL
+    DB_CACHE_SIZE_KB = 65536           # page cache per connection
+    DB_MMAP_SIZE = 268435456           # bytes of the database file to memory-map
+    DB_STATEMENT_CACHE = 256           # prepared statements kept per connection
+    EXPORT_FETCH_SIZE = 1000           # rows fetched and written per CSV export chunk
+    SEARCH_CACHE_ENTRIES = 128         # distinct searches kept in memory
+    SEARCH_CACHE_MAX_ROWS = 50000      # larger result sets are never cached
+    SEARCH_CACHE_TOTAL_ROWS = 500000   # rows held across all cached searches
+    SEARCH_CACHE_DIR = None            # set to a directory to keep an on-disk tier
+    SEARCH_CACHE_DISK_ENTRIES = 1024   # searches kept in the on-disk tier
+    LOCATION_INDEX_MAX_AGE = 300       # seconds before the state/city dropdown index is re-read
+    CITIES_CACHE_MAX_AGE = 60          # browser Cache-Control max-age for /get_cities
+    PRICE_HISTORY_COMPACT_AFTER_DAYS = 30    # older price changes are downsampled
+    PRICE_HISTORY_BUCKET_SECONDS = 86400     # downsampled points keep the low and high per bucket
+    PRICE_HISTORY_RETENTION_DAYS = 365       # price changes older than this are deleted
+    PRICE_HISTORY_COMPACT_INTERVAL_HOURS = 24
+    MAINTENANCE_BATCH_SIZE = 5000            # rows deleted per transaction by maintenance jobs
+    MAINTENANCE_BATCH_PAUSE = 0.05           # seconds maintenance jobs sleep between batches
+    RETENTION_DAYS = None                    # set to run the retention job on a schedule
+    RETENTION_INTERVAL_HOURS = 24
+    ZERO_INVENTORY_PURGE_HOURS = 24          # interval of the zero-inventory purge; None disables it
+    MAX_PRICE_REPORT_ERRORS = 50             # sample of rejected rows returned by the max-price import
+    MAX_PRICES_PAGE_SIZE = 100               # default page size of /get_max_prices
+    MAX_PRICES_PAGE_LIMIT = 1000             # largest page a client may request
+    API_SEARCH_PAGE_SIZE = 100               # default page size of /api/search
+    API_SEARCH_PAGE_LIMIT = 1000             # largest page a client may request
+    API_SEARCH_MAX_ZIPCODES = 1000           # zipcodes accepted by one /api/search request
+    SLOW_QUERY_SECONDS = 0.5                 # statements slower than this are logged with their parameters; None disables
+    TRACE_BUFFER_SIZE = 1000                 # recent spans kept for /trace_spans
+    TRACE_SLOW_SPAN_SECONDS = 30             # spans slower than this are logged as warnings; None disables
+    PROFILE_MAX_SECONDS = 60                 # longest capture /profile accepts
+    PROFILE_MAX_LIMIT = 1000                 # most functions a /profile report may list
+    
+
+
+class qmanager:
+    
+    manual_queue = Queue()
+    csv_queue = Queue()
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from config import Config
+from core.database import get_db_connection
+
+
+DATABASE = Config.DATABASE
+
+
+def get_data_version():
+    """Return the current data version from the database"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM data_version WHERE id = 1")
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(cursor=None):
+    """Invalidate cached search results after prices or inventory change.
+
+    Pass the cursor of an open write transaction to bump the version
+    atomically with the change itself.
+    """
+    if cursor is not None:
+        cursor.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+        return
+    with get_db_connection(DATABASE) as conn:
+        conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+        conn.commit()
+
+
+class SearchCache:
+    """LRU cache of search results with an optional on-disk tier.
+
+    Entries are tagged with the data version they were read at and are
+    ignored once the version moves on. The version lives in the database so
+    every worker process sees a bump made by any other.
+    """
+
+    def __init__(self, max_entries=Config.SEARCH_CACHE_ENTRIES, max_rows=Config.SEARCH_CACHE_MAX_ROWS,
+                 total_rows=Config.SEARCH_CACHE_TOTAL_ROWS, disk_dir=Config.SEARCH_CACHE_DIR,
+                 disk_entries=Config.SEARCH_CACHE_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.total_rows = total_rows
+        self.disk_dir = disk_dir
+        self.disk_entries = disk_entries
+        self.entries = OrderedDict()
+        self.cached_rows = 0
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key, version):
+        """Return cached rows for key at this data version, or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == version:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self._discard(key)
+
+        rows = self._disk_get(key, version)
+        if rows is not None:
+            self.stats["disk_hits"] += 1
+            self._remember(key, version, rows)
+            return rows
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key, version, rows):
+        """Cache rows read at the given data version"""
+        if len(rows) > self.max_rows:
+            return
+        self._remember(key, version, rows)
+        self._disk_put(key, version, rows)
+
+    def clear(self):
+        """Drop every cached entry"""
+        self.entries.clear()
+        self.cached_rows = 0
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def metrics(self):
+        """Return hit/miss counters and current size"""
+        return dict(self.stats, entries=len(self.entries), rows=self.cached_rows)
+
+    def _remember(self, key, version, rows):
+        if key in self.entries:
+            self._discard(key)
+        self.entries[key] = (version, rows)
+        self.cached_rows += len(rows)
+        while len(self.entries) > self.max_entries or self.cached_rows > self.total_rows:
+            oldest = next(iter(self.entries))
+            self._discard(oldest)
+            self.stats["evictions"] += 1
+
+    def _discard(self, key):
+        version, rows = self.entries.pop(key)
+        self.cached_rows -= len(rows)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def _disk_get(self, key, version):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_key, stored_version, rows = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if stored_key != key or stored_version != version:
+            return None
+        return rows
+
+    def _disk_put(self, key, version, rows):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((key, version, rows), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        except OSError as e:
+            print(f"Could not write search cache file {path}: {e}")
+
+    def _trim_disk(self):
+        files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith(".pkl")]
+        if len(files) <= self.disk_entries:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class LocationIndex:
+    """In-memory state -> cities index behind the search dropdowns.
+
+    Loaded once from stores and rebuilt only after the ingestion writer adds
+    a store. LOCATION_INDEX_MAX_AGE bounds staleness for stores added by
+    other worker processes.
+    """
+
+    def __init__(self, max_age=Config.LOCATION_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self.loaded_at = None
+        self.cities_by_state = {}
+        self.cities = []
+        self.states = []
+        self.etag = None
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def _ensure_loaded(self):
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age:
+            return
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT state, city FROM stores ORDER BY state, city")
+            rows = cursor.fetchall()
+
+        cities_by_state = {}
+        for state, city in rows:
+            cities_by_state.setdefault(state, []).append(city)
+        self.cities_by_state = cities_by_state
+        self.states = sorted(cities_by_state, key=lambda state: (state is not None, state))
+        self.cities = sorted({city for _, city in rows}, key=lambda city: (city is not None, city))
+        self.etag = hashlib.sha1(repr(rows).encode("utf-8")).hexdigest()
+        self.loaded_at = time.monotonic()
+
+    def get_states(self):
+        self._ensure_loaded()
+        return self.states
+
+    def get_cities(self, state=None):
+        """Return every city, or the cities of one state"""
+        self._ensure_loaded()
+        if state is None:
+            return self.cities
+        return self.cities_by_state.get(state, [])
+
+    def get_etag(self):
+        self._ensure_loaded()
+        return self.etag
+
+
+search_cache = SearchCache()
+location_index = LocationIndex()
@@ -1,119 +1,444 @@
-import sqlite3
-from config import Config
-
-
-DATABASE = Config.DATABASE
-UPCZIP_DB = Config.UPCZIP_DB
-
-def alter_max_prices():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    # Get existing column names from the table
-    cursor.execute("PRAGMA table_info(upc_max_prices)")
-    existing_columns = [col[1] for col in cursor.fetchall()]
-
-    # Define the columns you want to add (name and type)
-    new_columns = {
-        "net": "REAL",          # change to the correct type if needed
-        "department": "TEXT",    # change to the correct type if needed
-        "productid" : "TEXT"
-    }
-
-    # Loop through and add only the missing ones
-    for column_name, column_type in new_columns.items():
-        if column_name not in existing_columns:
-            cursor.execute(f"ALTER TABLE upc_max_prices ADD COLUMN {column_name} {column_type}")
-            print(f"Added column: {column_name}")
-        
-
-    conn.commit()
-    conn.close()
-    
-    
-def get_db_connection(db_path):
-        """Create and return a database connection"""
-        conn = sqlite3.connect(db_path)
-        return conn
-
-def init_databases():
-    """Initialize all necessary database tables"""
-    # UPC-ZIP database
-    with get_db_connection(UPCZIP_DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS upczip (
-                upc TEXT NOT NULL,
-                zip TEXT NOT NULL,
-                timestamp INTEGER NOT NULL,
-                PRIMARY KEY (upc, zip)
-            )
-        """)
-        conn.commit()
-    
-    # Main database
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-        cursor.executescript("""
-            CREATE TABLE IF NOT EXISTS stores (
-                id INTEGER PRIMARY KEY, 
-                address TEXT, 
-                city TEXT, 
-                state TEXT, 
-                zipcode TEXT, 
-                motherZip TEXT, 
-                store_url TEXT
-            );
-
-            CREATE TABLE IF NOT EXISTS items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                name TEXT NOT NULL, 
-                upc TEXT UNIQUE NOT NULL, 
-                msrp REAL, 
-                image_url TEXT, 
-                item_url TEXT
-            );
-
-            CREATE TABLE IF NOT EXISTS store_items (
-                store_id INTEGER, 
-                item_id INTEGER, 
-                price REAL, 
-                salesfloor INTEGER DEFAULT 0, 
-                backroom INTEGER DEFAULT 0,
-                aisles TEXT DEFAULT NULL,
-                PRIMARY KEY (store_id, item_id),
-                FOREIGN KEY (store_id) REFERENCES stores(id),
-                FOREIGN KEY (item_id) REFERENCES items(id)
-            );
-            
-            CREATE TABLE IF NOT EXISTS upc_max_prices (
-                upc TEXT PRIMARY KEY,
-                max_price REAL NOT NULL,
-                description TEXT
-            );
-        """)
-        conn.commit()
-        
-        
-def create_indexes():
-    """Create indexes to optimize query performance"""
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-        
-        # Indexes for the main search query
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_items_upc ON items(upc)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_motherzip ON stores(motherZip)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_city ON stores(city)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_state ON stores(state)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_price ON store_items(price)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_store_id ON store_items(store_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_item_id ON store_items(item_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_upc_max_prices_upc ON upc_max_prices(upc)")
-        
-        # Composite indexes for common query patterns
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_city_state ON stores(city, state)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_price_inventory ON store_items(price, salesfloor, backroom)")
-        
-        
-        conn.commit()
-        print("Database indexes created successfully")
\ No newline at end of file
+import sqlite3
+import time
+from contextlib import contextmanager
+import gevent
+from gevent.lock import BoundedSemaphore
+from config import Config
+from core.tracing import TracedConnection
+
+
+DATABASE = Config.DATABASE
+UPCZIP_DB = Config.UPCZIP_DB
+
+
+class ConnectionPool:
+    """Pool of tuned SQLite connections for one database file.
+
+    Each greenlet checks out its own connection; nested get_db_connection
+    calls in the same greenlet reuse it. Connections run in WAL mode so the
+    ingestion writer no longer blocks readers.
+    """
+
+    def __init__(self, db_path, size=Config.DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.idle = []
+        self.checked_out = {}
+        self.slots = BoundedSemaphore(size)
+        self.stats = {
+            "created": 0,
+            "checkouts": 0,
+            "reused": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=Config.DB_BUSY_TIMEOUT,
+            cached_statements=Config.DB_STATEMENT_CACHE,
+            check_same_thread=False,
+            # Logs slow statements with their parameters; see core.tracing
+            factory=TracedConnection if Config.SLOW_QUERY_SECONDS is not None else sqlite3.Connection,
+        )
+        # Only takes effect on a new database file; lets the retention job
+        # hand freed pages back with incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={Config.DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{int(Config.DB_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(Config.DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        self.stats["created"] += 1
+        return conn
+
+    def _acquire(self):
+        if not self.slots.acquire(blocking=False):
+            self.stats["waits"] += 1
+            started = time.perf_counter()
+            self.slots.acquire()
+            self.stats["wait_time"] += time.perf_counter() - started
+        self.stats["checkouts"] += 1
+        if self.idle:
+            self.stats["reused"] += 1
+            return self.idle.pop()
+        try:
+            return self._connect()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.append(conn)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commits on success, rolls back on error"""
+        owner = gevent.getcurrent()
+        entry = self.checked_out.get(owner)
+        if entry is None:
+            entry = self.checked_out[owner] = [self._acquire(), 0]
+        conn = entry[0]
+        entry[1] += 1
+        try:
+            with conn:
+                yield conn
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.checked_out[owner]
+                self._release(conn)
+
+    def metrics(self):
+        """Return usage counters for this pool"""
+        return dict(
+            self.stats,
+            db_path=self.db_path,
+            size=self.size,
+            in_use=len(self.checked_out),
+            idle=len(self.idle),
+        )
+
+
+pools = {}
+
+
+def get_pool(db_path):
+    """Return the connection pool for a database file, creating it on first use"""
+    pool = pools.get(db_path)
+    if pool is None:
+        pool = pools[db_path] = ConnectionPool(db_path)
+    return pool
+
+
+def get_db_connection(db_path):
+    """Check out a pooled connection for use in a with-block"""
+    return get_pool(db_path).connection()
+
+
+def open_dedicated_connection(db_path):
+    """Open a tuned connection outside the pool for long-running maintenance; the caller closes it"""
+    return get_pool(db_path)._connect()
+
+
+def pool_stats():
+    """Return metrics for every connection pool"""
+    return [pool.metrics() for pool in pools.values()]
+
+
+def alter_max_prices():
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+
+        # Get existing column names from the table
+        cursor.execute("PRAGMA table_info(upc_max_prices)")
+        existing_columns = [col[1] for col in cursor.fetchall()]
+
+        # Define the columns you want to add (name and type)
+        new_columns = {
+            "net": "REAL",          # change to the correct type if needed
+            "department": "TEXT",    # change to the correct type if needed
+            "productid" : "TEXT"
+        }
+
+        # Loop through and add only the missing ones
+        for column_name, column_type in new_columns.items():
+            if column_name not in existing_columns:
+                cursor.execute(f"ALTER TABLE upc_max_prices ADD COLUMN {column_name} {column_type}")
+                print(f"Added column: {column_name}")
+            
+
+        conn.commit()
+
+def alter_ingest_jobs():
+    """Add the queue and journal columns to ingest_jobs tables created before them"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA table_info(ingest_jobs)")
+        existing_columns = [col[1] for col in cursor.fetchall()]
+
+        new_columns = {
+            "kind": "TEXT NOT NULL DEFAULT 'csv'",
+            "payload": "TEXT",
+            "priority": "INTEGER NOT NULL DEFAULT 2",
+            "lease_owner": "TEXT",
+            "lease_expires": "INTEGER",
+            "heartbeat_at": "INTEGER",
+            "last_run_at": "INTEGER",
+            "filename": "TEXT",
+            "rows_succeeded": "INTEGER NOT NULL DEFAULT 0",
+            "rows_failed": "INTEGER NOT NULL DEFAULT 0",
+            "rows_skipped": "INTEGER NOT NULL DEFAULT 0",
+            "started_at": "INTEGER",
+            "finished_at": "INTEGER",
+            "run_seconds": "REAL NOT NULL DEFAULT 0",
+        }
+        for column_name, column_type in new_columns.items():
+            if column_name not in existing_columns:
+                cursor.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column_name} {column_type}")
+                print(f"Added column: {column_name}")
+
+        # Claim order: manual entries first, then the CSV job that ran least recently
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_claim ON ingest_jobs(status, priority, last_run_at, id)")
+        conn.commit()
+
+def init_databases():
+    """Initialize all necessary database tables"""
+    # UPC-ZIP database
+    with get_db_connection(UPCZIP_DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS upczip (
+                upc TEXT NOT NULL,
+                zip TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                PRIMARY KEY (upc, zip)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_upczip_timestamp ON upczip(timestamp)")
+        conn.commit()
+    
+    # Main database
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.executescript("""
+            CREATE TABLE IF NOT EXISTS stores (
+                id INTEGER PRIMARY KEY, 
+                address TEXT, 
+                city TEXT, 
+                state TEXT, 
+                zipcode TEXT, 
+                motherZip TEXT, 
+                store_url TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                name TEXT NOT NULL, 
+                upc TEXT UNIQUE NOT NULL, 
+                msrp REAL, 
+                image_url TEXT, 
+                item_url TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS store_items (
+                store_id INTEGER, 
+                item_id INTEGER, 
+                price REAL, 
+                salesfloor INTEGER DEFAULT 0, 
+                backroom INTEGER DEFAULT 0,
+                aisles TEXT DEFAULT NULL,
+                PRIMARY KEY (store_id, item_id),
+                FOREIGN KEY (store_id) REFERENCES stores(id),
+                FOREIGN KEY (item_id) REFERENCES items(id)
+            );
+            
+            CREATE TABLE IF NOT EXISTS upc_max_prices (
+                upc TEXT PRIMARY KEY,
+                max_price REAL NOT NULL,
+                description TEXT
+            );
+
+            -- Bumped whenever prices change so cached search results expire
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0);
+
+            -- Delta-encoded price changes: a row is written only when a
+            -- store's price for an item changes and holds the price that was
+            -- replaced at that timestamp
+            CREATE TABLE IF NOT EXISTS price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                store_id INTEGER NOT NULL,
+                item_id INTEGER NOT NULL,
+                price REAL,
+                timestamp INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_price_history_item_store_time ON price_history(item_id, store_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_price_history_timestamp ON price_history(timestamp);
+
+            -- Lookups that failed after every retry
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                upc TEXT NOT NULL,
+                zip TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER,
+                created_at INTEGER NOT NULL
+            );
+
+            -- Durable ingestion queue shared by every worker process: one row
+            -- per uploaded CSV/XLSX or manual entry. row_cursor is the number
+            -- of data rows written so far; a worker owns a running job while
+            -- its lease is current and renews it with heartbeats. The rows_*
+            -- counts and run_seconds journal the rows before row_cursor.
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filepath TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                row_cursor INTEGER NOT NULL DEFAULT 0,
+                total_rows INTEGER,
+                created_at INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'csv',
+                payload TEXT,
+                priority INTEGER NOT NULL DEFAULT 2,
+                lease_owner TEXT,
+                lease_expires INTEGER,
+                heartbeat_at INTEGER,
+                last_run_at INTEGER,
+                filename TEXT,
+                rows_succeeded INTEGER NOT NULL DEFAULT 0,
+                rows_failed INTEGER NOT NULL DEFAULT 0,
+                rows_skipped INTEGER NOT NULL DEFAULT 0,
+                started_at INTEGER,
+                finished_at INTEGER,
+                run_seconds REAL NOT NULL DEFAULT 0
+            );
+        """)
+        conn.commit()
+        
+        
+def create_indexes():
+    """Create indexes to optimize query performance"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        
+        # Superseded by UNIQUE/PRIMARY KEY constraints or by a composite
+        # index with the same leading column; every extra index slows ingestion
+        for index in ("idx_items_upc", "idx_upc_max_prices_upc", "idx_stores_city", "idx_stores_state",
+                      "idx_store_items_store_id", "idx_store_items_item_id", "idx_store_items_price"):
+            cursor.execute(f"DROP INDEX IF EXISTS {index}")
+        
+        # Indexes for the search shapes in core.search.build_search_query;
+        # benchmarks/query_plans.py records their plans. stores.id is the
+        # rowid, so the stores indexes below cover the join to store_items,
+        # whose primary key (store_id, item_id) serves the store -> item side.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_motherzip ON stores(motherZip)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_state_city ON stores(state, city)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stores_city_state ON stores(city, state)")
+        # UPC searches: item -> stores, with the price filter checked in the index
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_item_price ON store_items(item_id, price, store_id)")
+        # Price-only searches
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_price_inventory ON store_items(price, salesfloor, backroom)")
+        # In-stock rows only, for searches with the zero-inventory filter
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_store_items_in_stock ON store_items(item_id, store_id) WHERE salesfloor > 0 OR backroom > 0")
+        
+        # Keyset pagination of the max-price list; the expressions match the
+        # ORDER BY in /get_max_prices so NULL descriptions sort as ''
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_upc_max_prices_description ON upc_max_prices(COALESCE(description, ''), upc)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_upc_max_prices_department ON upc_max_prices(COALESCE(department, ''), upc)")
+        
+        
+        # Refresh planner statistics for tables whose indexes changed
+        cursor.execute("PRAGMA optimize")
+        conn.commit()
+        print("Database indexes created successfully")
+
+
+def create_deals_table():
+    """Create the materialized deals table and the triggers that maintain it.
+
+    A deal is a store_items row priced at or below its UPC's max price.
+    Triggers on store_items and upc_max_prices keep the table current, so
+    deal searches read it instead of joining and filtering at query time.
+    """
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'deals'")
+        exists = cursor.fetchone() is not None
+
+        cursor.executescript("""
+            CREATE TABLE IF NOT EXISTS deals (
+                store_id INTEGER NOT NULL,
+                item_id INTEGER NOT NULL,
+                price REAL,
+                max_price REAL,
+                margin REAL,
+                PRIMARY KEY (store_id, item_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_deals_item_id ON deals(item_id);
+            CREATE INDEX IF NOT EXISTS idx_deals_margin ON deals(margin DESC);
+
+            CREATE TRIGGER IF NOT EXISTS trg_deals_store_items_insert
+            AFTER INSERT ON store_items
+            BEGIN
+                INSERT OR REPLACE INTO deals (store_id, item_id, price, max_price, margin)
+                SELECT NEW.store_id, NEW.item_id, NEW.price, ump.max_price, ump.max_price - NEW.price
+                FROM items i
+                JOIN upc_max_prices ump ON ump.upc = i.upc
+                WHERE i.id = NEW.item_id AND NEW.price <= ump.max_price;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_deals_store_items_update
+            AFTER UPDATE OF price ON store_items
+            WHEN OLD.price IS NOT NEW.price
+            BEGIN
+                DELETE FROM deals WHERE store_id = OLD.store_id AND item_id = OLD.item_id;
+                INSERT OR REPLACE INTO deals (store_id, item_id, price, max_price, margin)
+                SELECT NEW.store_id, NEW.item_id, NEW.price, ump.max_price, ump.max_price - NEW.price
+                FROM items i
+                JOIN upc_max_prices ump ON ump.upc = i.upc
+                WHERE i.id = NEW.item_id AND NEW.price <= ump.max_price;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_deals_store_items_delete
+            AFTER DELETE ON store_items
+            BEGIN
+                DELETE FROM deals WHERE store_id = OLD.store_id AND item_id = OLD.item_id;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_deals_max_prices_insert
+            AFTER INSERT ON upc_max_prices
+            BEGIN
+                DELETE FROM deals WHERE item_id IN (SELECT id FROM items WHERE upc = NEW.upc);
+                INSERT INTO deals (store_id, item_id, price, max_price, margin)
+                SELECT si.store_id, si.item_id, si.price, NEW.max_price, NEW.max_price - si.price
+                FROM items i
+                JOIN store_items si ON si.item_id = i.id
+                WHERE i.upc = NEW.upc AND si.price <= NEW.max_price;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_deals_max_prices_update
+            AFTER UPDATE OF max_price ON upc_max_prices
+            WHEN OLD.max_price IS NOT NEW.max_price
+            BEGIN
+                DELETE FROM deals WHERE item_id IN (SELECT id FROM items WHERE upc = NEW.upc);
+                INSERT INTO deals (store_id, item_id, price, max_price, margin)
+                SELECT si.store_id, si.item_id, si.price, NEW.max_price, NEW.max_price - si.price
+                FROM items i
+                JOIN store_items si ON si.item_id = i.id
+                WHERE i.upc = NEW.upc AND si.price <= NEW.max_price;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_deals_max_prices_delete
+            AFTER DELETE ON upc_max_prices
+            BEGIN
+                DELETE FROM deals WHERE item_id IN (SELECT id FROM items WHERE upc = OLD.upc);
+            END;
+        """)
+
+        # Backfill once for databases that predate the table
+        if not exists:
+            rebuild_deals(cursor)
+        conn.commit()
+        print("Deals table ready")
+
+
+def rebuild_deals(cursor):
+    """Recompute the whole deals table from store_items and upc_max_prices"""
+    cursor.execute("DELETE FROM deals")
+    cursor.execute("""
+        INSERT INTO deals (store_id, item_id, price, max_price, margin)
+        SELECT si.store_id, si.item_id, si.price, ump.max_price, ump.max_price - si.price
+        FROM store_items si
+        JOIN items i ON si.item_id = i.id
+        JOIN upc_max_prices ump ON i.upc = ump.upc
+        WHERE si.price <= ump.max_price
+    """)
@@ -0,0 +1,333 @@
+import json
+import os
+import socket
+import time
+from enum import IntEnum
+from gevent.event import Event
+from config import Config
+from core.database import get_db_connection
+
+
+DATABASE = Config.DATABASE
+
+JOB_COLUMNS = (
+    "id", "filepath", "status", "row_cursor", "total_rows", "created_at", "updated_at",
+    "kind", "payload", "priority", "lease_owner", "lease_expires", "heartbeat_at", "last_run_at",
+    "filename", "rows_succeeded", "rows_failed", "rows_skipped", "started_at", "finished_at", "run_seconds",
+)
+
+# Journal counters that checkpoints add to rather than overwrite
+JOURNAL_COUNTS = ("rows_succeeded", "rows_failed", "rows_skipped")
+
+# Jobs a worker may claim; a running job whose lease expired is claimable too
+WAITING_STATUSES = ("queued", "paused")
+
+
+class Priority(IntEnum):
+    HIGH = 1    # Manual input (higher priority)
+    LOW = 2     # CSV batch processing (lower priority)
+
+
+def worker_id():
+    """Identify this worker process; computed per call so forked workers differ"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def create_job(filepath, kind="csv", payload=None, priority=Priority.LOW, filename=None):
+    """Register an uploaded file (or a manual entry) for ingestion and return its job id"""
+    now = int(time.time())
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO ingest_jobs (filepath, status, row_cursor, created_at, updated_at, kind, payload, priority, filename)
+            VALUES (?, 'queued', 0, ?, ?, ?, ?, ?, ?)
+        """, (filepath, now, now, kind, payload, int(priority), filename))
+        conn.commit()
+        return cursor.lastrowid
+
+
+def get_job(job_id):
+    """Return a job as a dict, or None if it does not exist"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM ingest_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+    return dict(zip(JOB_COLUMNS, row)) if row else None
+
+
+def update_job(job_id, **fields):
+    """Persist changed job fields such as status, row_cursor or total_rows"""
+    fields["updated_at"] = int(time.time())
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with get_db_connection(DATABASE) as conn:
+        conn.execute(f"UPDATE ingest_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+
+def list_jobs(status=None, limit=100):
+    """Return the most recent CSV jobs, newest first, optionally filtered by status"""
+    query = f"SELECT {', '.join(JOB_COLUMNS)} FROM ingest_jobs WHERE kind = 'csv'"
+    params = []
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [dict(zip(JOB_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def job_summary(job):
+    """Journal view of a job for the /jobs API, with throughput and ETA"""
+    total = job["total_rows"]
+    done = job["row_cursor"]
+    rows_per_second = done / job["run_seconds"] if job["run_seconds"] else None
+    remaining = total - done if total is not None else None
+    eta_seconds = None
+    if remaining and rows_per_second and job["status"] not in ("done", "failed", "cancelled"):
+        eta_seconds = round(remaining / rows_per_second)
+    return {
+        "id": job["id"],
+        "filename": job["filename"] or os.path.basename(job["filepath"]),
+        "status": job["status"],
+        "row_cursor": done,
+        "total_rows": total,
+        "percent": round(done / total * 100, 1) if total else None,
+        "rows_succeeded": job["rows_succeeded"],
+        "rows_failed": job["rows_failed"],
+        "rows_skipped": job["rows_skipped"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "run_seconds": round(job["run_seconds"], 1),
+        "rows_per_second": round(rows_per_second, 2) if rows_per_second else None,
+        "eta_seconds": eta_seconds,
+        "worker": job["lease_owner"],
+    }
+
+
+def recover_jobs():
+    """Release running jobs left behind by dead worker processes on this host.
+
+    Leases of other hosts are left to expire; here the owner can be checked
+    directly, so an ingest interrupted by a restart resumes straight away
+    from its last checkpoint instead of after JOB_LEASE_SECONDS. Returns the
+    ids of the released jobs.
+    """
+    host = socket.gethostname()
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, lease_owner FROM ingest_jobs WHERE status = 'running' AND lease_owner LIKE ?", (f"{host}:%",))
+        stale = [job_id for job_id, owner in cursor.fetchall() if not worker_alive(owner)]
+        for job_id in stale:
+            # Paused jobs are claimed ahead of the other uploads
+            cursor.execute("""
+                UPDATE ingest_jobs SET status = 'paused', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                WHERE id = ? AND status = 'running'
+            """, (int(time.time()), job_id))
+        conn.commit()
+    return stale
+
+
+def worker_alive(owner):
+    """Return True if the process named by a hostname:pid lease owner is running"""
+    pid = int(owner.rsplit(":", 1)[1])
+    # A restarted container often reuses the old pid; a fresh process owns nothing yet
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """Durable ingestion queue stored in the ingest_jobs table.
+
+    Any number of worker processes claim jobs with a single UPDATE ...
+    RETURNING inside BEGIN IMMEDIATE, so a job is handed to exactly one of
+    them. The owner holds a lease that it renews with heartbeats and
+    checkpoints; if the process dies, the lease expires and another worker
+    resumes the job from its last checkpoint. Manual entries (HIGH) are
+    claimed before CSV jobs (LOW); a CSV job paused for one resumes first,
+    and the others rotate by last_run_at.
+    """
+
+    def __init__(self):
+        self.ready = Event()
+        self.manual_checked_at = 0.0
+        self.manual_waiting = False
+        self.csv_checked_at = 0.0
+        self.csv_waiting = False
+        # Ids of the jobs this process holds and is working on; only their
+        # leases are renewed by heartbeat
+        self.active = set()
+
+    def put_manual(self, upc, zip_code):
+        """Queue a manual UPC-ZIP lookup ahead of every CSV job"""
+        job_id = create_job("", kind="manual", payload=json.dumps({"upc": upc, "zip": zip_code}), priority=Priority.HIGH)
+        self.manual_waiting = True
+        self.ready.set()
+        return job_id
+
+    def put_csv(self, job_id):
+        """Wake the local worker for a CSV job created with create_job"""
+        self.csv_waiting = True
+        self.ready.set()
+
+    def claim(self):
+        """Lease the next job to this worker; returns the job dict or None"""
+        now = int(time.time())
+        with get_db_connection(DATABASE) as conn:
+            # IMMEDIATE takes the write lock up front, so two processes can
+            # never pick the same row between the SELECT and the UPDATE
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(f"""
+                UPDATE ingest_jobs
+                SET status = 'running', lease_owner = ?, lease_expires = ?, heartbeat_at = ?,
+                    last_run_at = ?, updated_at = ?, started_at = COALESCE(started_at, ?)
+                WHERE id = (
+                    SELECT id FROM ingest_jobs
+                    WHERE status IN ('queued', 'paused')
+                       OR (status = 'running' AND lease_expires < ?)
+                    ORDER BY priority, status != 'paused', last_run_at IS NOT NULL, last_run_at, id
+                    LIMIT 1
+                )
+                RETURNING {', '.join(JOB_COLUMNS)}
+            """, (worker_id(), now + Config.JOB_LEASE_SECONDS, now, now, now, now, now))
+            row = cursor.fetchone()
+            conn.commit()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        self.active.add(job["id"])
+        return job
+
+    def get(self):
+        """Claim the next job, waiting until one is available"""
+        while True:
+            self.ready.clear()
+            job = self.claim()
+            if job is not None:
+                return job
+            # Local puts wake us at once; jobs queued by other processes are
+            # picked up on the next poll
+            self.ready.wait(Config.QUEUE_POLL_INTERVAL)
+
+    def checkpoint(self, job_id, journal=None, **fields):
+        """Save progress and renew the lease; returns False if another worker took the job over.
+
+        journal holds the rows_* counts and run_seconds accumulated since the
+        previous checkpoint; they are added to the stored totals.
+        """
+        now = int(time.time())
+        fields = {"updated_at": now, "heartbeat_at": now, "lease_expires": now + Config.JOB_LEASE_SECONDS, **fields}
+        assignments = [f"{name} = ?" for name in fields]
+        params = list(fields.values())
+        for name, delta in (journal or {}).items():
+            assignments.append(f"{name} = {name} + ?")
+            params.append(delta)
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.execute(
+                f"UPDATE ingest_jobs SET {', '.join(assignments)} WHERE id = ? AND lease_owner = ?",
+                (*params, job_id, worker_id()),
+            )
+            conn.commit()
+            updated = cursor.rowcount == 1
+        if not updated:
+            # Another worker took the job over, so its lease is no longer ours to renew
+            self.active.discard(job_id)
+            return False
+        return True
+
+    def release(self, job_id, status, journal=None, **fields):
+        """Give up the lease, leaving the job in status (queued, paused, done or failed)"""
+        fields.update(status=status, lease_owner=None, lease_expires=None)
+        if status in ("done", "failed"):
+            fields["finished_at"] = int(time.time())
+        released = self.checkpoint(job_id, journal, **fields)
+        self.active.discard(job_id)
+        return released
+
+    def abandon(self, job_id):
+        """Stop renewing a job's lease so another worker reclaims it once it expires"""
+        self.active.discard(job_id)
+
+    def heartbeat(self):
+        """Renew the leases of the jobs this process is working on"""
+        job_ids = list(self.active)
+        if not job_ids:
+            return
+        now = int(time.time())
+        with get_db_connection(DATABASE) as conn:
+            conn.execute(f"""
+                UPDATE ingest_jobs SET heartbeat_at = ?, lease_expires = ?
+                WHERE status = 'running' AND lease_owner = ? AND id IN ({', '.join('?' * len(job_ids))})
+            """, (now, now + Config.JOB_LEASE_SECONDS, worker_id(), *job_ids))
+            conn.commit()
+
+    def complete_manual(self, job_id):
+        """Drop a processed manual entry from the queue"""
+        with get_db_connection(DATABASE) as conn:
+            conn.execute("DELETE FROM ingest_jobs WHERE id = ? AND kind = 'manual'", (job_id,))
+            conn.commit()
+        self.active.discard(job_id)
+
+    def has_manual(self):
+        """Return True if a manual entry is waiting.
+
+        Called before every CSV row, so the database is asked at most once
+        per QUEUE_POLL_INTERVAL unless this process queued one itself.
+        """
+        now = time.monotonic()
+        if self.manual_waiting or now - self.manual_checked_at >= Config.QUEUE_POLL_INTERVAL:
+            self.manual_checked_at = now
+            self.manual_waiting = self.lane_sizes()["manual"] > 0
+        return self.manual_waiting
+
+    def has_csv(self):
+        """Return True if another CSV job is waiting; throttled like has_manual"""
+        now = time.monotonic()
+        if self.csv_waiting or now - self.csv_checked_at >= Config.QUEUE_POLL_INTERVAL:
+            self.csv_checked_at = now
+            self.csv_waiting = self.lane_sizes()["csv"] > 0
+        return self.csv_waiting
+
+    def lane_sizes(self):
+        """Count waiting jobs per kind"""
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.execute(f"""
+                SELECT kind, COUNT(*) FROM ingest_jobs
+                WHERE status IN ({', '.join('?' * len(WAITING_STATUSES))})
+                GROUP BY kind
+            """, WAITING_STATUSES)
+            counts = dict(cursor.fetchall())
+        return {"manual": counts.get("manual", 0), "csv": counts.get("csv", 0)}
+
+    def qsize(self):
+        return sum(self.lane_sizes().values())
+
+    def clear(self):
+        """Drop waiting manual entries and cancel waiting CSV jobs; returns how many were removed"""
+        placeholders = ", ".join("?" * len(WAITING_STATUSES))
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DELETE FROM ingest_jobs WHERE kind = 'manual' AND status IN ({placeholders})", WAITING_STATUSES)
+            count = cursor.rowcount
+            cursor.execute(f"""
+                UPDATE ingest_jobs SET status = 'cancelled', updated_at = ?
+                WHERE kind = 'csv' AND status IN ({placeholders})
+            """, (int(time.time()), *WAITING_STATUSES))
+            count += cursor.rowcount
+            conn.commit()
+        self.manual_waiting = False
+        self.csv_waiting = False
+        return count
+
+
+job_queue = JobQueue()
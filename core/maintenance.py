@@ -0,0 +1,52 @@
+from apscheduler.schedulers.gevent import GeventScheduler
+from config import Config
+from core.price_history import compact_price_history
+from core.retention import run_retention, is_retention_running, purge_zero_inventory
+
+
+maintenance_scheduler = GeventScheduler()
+
+
+def start_maintenance():
+    """Schedule periodic database maintenance jobs"""
+    if maintenance_scheduler.running:
+        return
+    maintenance_scheduler.add_job(
+        compact_price_history,
+        "interval",
+        hours=Config.PRICE_HISTORY_COMPACT_INTERVAL_HOURS,
+        id="compact_price_history",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1,
+    )
+    if Config.RETENTION_DAYS:
+        maintenance_scheduler.add_job(
+            run_retention,
+            "interval",
+            args=[Config.RETENTION_DAYS],
+            hours=Config.RETENTION_INTERVAL_HOURS,
+            id="retention",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+    if Config.ZERO_INVENTORY_PURGE_HOURS:
+        maintenance_scheduler.add_job(
+            purge_zero_inventory,
+            "interval",
+            hours=Config.ZERO_INVENTORY_PURGE_HOURS,
+            id="purge_zero_inventory",
+            replace_existing=True,
+            coalesce=True,
+            max_instances=1,
+        )
+    maintenance_scheduler.start()
+
+
+def schedule_retention(days):
+    """Run the retention job now in the background; returns False if one is already running"""
+    if is_retention_running():
+        return False
+    maintenance_scheduler.add_job(run_retention, args=[days], id="retention_now", replace_existing=True)
+    return True
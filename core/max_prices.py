@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+from config import Config
+
+
+# Currency symbols, thousands separators and whitespace around prices
+PRICE_NOISE = r"[$£€,\s]"
+
+OPTIONAL_COLUMNS = ["DESCRIPTION", "NET", "DEPARTMENT", "PRODUCTID"]
+
+
+def parse_prices(series):
+    """Strip currency noise from a text column and parse it as floats (NaN when invalid)"""
+    cleaned = series.str.replace(PRICE_NOISE, "", regex=True)
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def load_max_prices(file):
+    """Read and validate a max-price CSV with column-wise pandas operations.
+
+    Returns (records, report) where records are upsert tuples for
+    upc_max_prices, or (None, message) if the required columns are missing.
+    Rows with a blank UPC or an unparseable price are rejected; a bad NET
+    is stored as NULL like the row-by-row import did. Repeated UPCs keep
+    the last row.
+    """
+    df = pd.read_csv(file, dtype=str, keep_default_na=False, encoding="utf-8", skipinitialspace=True)
+    df.columns = [str(column).strip().upper() for column in df.columns]
+
+    if "UPC" not in df.columns or "PRICE" not in df.columns:
+        return None, "CSV must contain UPC and PRICE columns"
+
+    for column in OPTIONAL_COLUMNS:
+        if column not in df.columns:
+            df[column] = ""
+
+    total_rows = len(df)
+    upc = df["UPC"].str.strip()
+    description = df["DESCRIPTION"].str.strip()
+    department = df["DEPARTMENT"].str.strip()
+    productid = df["PRODUCTID"].str.strip()
+    price = parse_prices(df["PRICE"])
+    net = parse_prices(df["NET"])
+
+    missing_upc = upc == ""
+    invalid_price = ~missing_upc & price.isna()
+    invalid_net = ~missing_upc & ~invalid_price & net.isna() & (df["NET"].str.strip() != "")
+    rejected = missing_upc | invalid_price
+
+    valid = pd.DataFrame({
+        "upc": upc,
+        "max_price": price,
+        "description": description,
+        "net": net,
+        "department": department,
+        "productid": productid,
+    })[~rejected]
+    duplicates = valid["upc"].duplicated(keep="last")
+    valid = valid[~duplicates]
+
+    # NaN -> None so sqlite stores NULL for a missing NET
+    valid = valid.astype(object).where(valid.notna(), None)
+    records = list(valid.itertuples(index=False, name=None))
+
+    # Header is line 1, so the first data row is line 2
+    errors = []
+    for line, reason in (
+        *((index + 2, "missing UPC") for index in np.flatnonzero(missing_upc.to_numpy())),
+        *((index + 2, "invalid PRICE") for index in np.flatnonzero(invalid_price.to_numpy())),
+    ):
+        if len(errors) >= Config.MAX_PRICE_REPORT_ERRORS:
+            break
+        errors.append({"line": int(line), "error": reason})
+
+    report = {
+        "rows": total_rows,
+        "imported": len(records),
+        "missing_upc": int(missing_upc.sum()),
+        "invalid_price": int(invalid_price.sum()),
+        "invalid_net": int(invalid_net.sum()),
+        "duplicate_upc": int(duplicates.sum()),
+        "errors": sorted(errors, key=lambda error: error["line"]),
+    }
+    return records, report
@@ -0,0 +1,192 @@
+import bisect
+import math
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds for latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    """Base for in-process metrics; values are kept per tuple of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+    def _label_dict(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, key, value, None) for key, value in self.values.items()]
+
+    def snapshot(self):
+        if not self.labelnames:
+            return self.values.get((), 0)
+        return [dict(self._label_dict(key), value=value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Value that goes up and down; func, if given, is called on every read.
+
+    func returns a number, or a dict mapping label-value tuples to numbers
+    for a gauge with labels.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+        self.func = func
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def read(self):
+        if self.func is None:
+            return self.values
+        value = self.func()
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self):
+        return [(self.name, key, value, None) for key, value in self.read().items() if value is not None]
+
+    def snapshot(self):
+        values = self.read()
+        if not self.labelnames:
+            return values.get(())
+        return [dict(self._label_dict(key), value=value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in fixed buckets, with sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q, **labels):
+        """Estimate a quantile by interpolating within its bucket"""
+        series = self.series.get(self._key(labels))
+        if not series or not series["count"]:
+            return None
+        return self._quantile(series, q)
+
+    def _quantile(self, series, q):
+        rank = q * series["count"]
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets + (math.inf,), series["counts"]):
+            if count and seen + count >= rank:
+                if upper == math.inf:
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+    def samples(self):
+        samples = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for upper, count in zip(self.buckets + (math.inf,), series["counts"]):
+                cumulative += count
+                bound = "+Inf" if upper == math.inf else repr(upper)
+                samples.append((f"{self.name}_bucket", key, cumulative, ("le", bound)))
+            samples.append((f"{self.name}_sum", key, series["sum"], None))
+            samples.append((f"{self.name}_count", key, series["count"], None))
+        return samples
+
+    def snapshot(self):
+        result = []
+        for key, series in self.series.items():
+            result.append(dict(
+                self._label_dict(key),
+                count=series["count"],
+                mean=round(series["sum"] / series["count"], 6) if series["count"] else None,
+                p50=round(self._quantile(series, 0.5), 6),
+                p90=round(self._quantile(series, 0.9), 6),
+                p99=round(self._quantile(series, 0.99), 6),
+            ))
+        return result
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus():
+    """Return every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value, extra in metric.samples():
+            lines.append(f"{name}{metric._label_text(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_snapshot():
+    """Return every metric as JSON-friendly values keyed by name"""
+    return {metric.name: metric.snapshot() for metric in registry}
+
+
+registry = []
+
+# Ingestion
+ingest_rows = Counter("ingest_rows_total", "CSV rows handled, by result", ["result"])
+upstream_latency = Histogram("upstream_request_seconds", "Stock API request latency per attempt", ["outcome"])
+db_write_latency = Histogram("db_write_seconds", "Batch write transaction latency", ["target"])
+db_write_rows = Counter("db_write_rows_total", "Rows written by batch writes", ["target"])
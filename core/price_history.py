@@ -0,0 +1,169 @@
+import time
+import gevent
+from config import Config
+from core.database import get_db_connection
+from utils import log_message
+
+
+DATABASE = Config.DATABASE
+
+DAY = 24 * 60 * 60
+
+
+def _window(since, until):
+    until = int(until if until is not None else time.time())
+    since = int(since if since is not None else 0)
+    return since, until
+
+
+def get_price_series(upc, store_id=None, since=None, until=None):
+    """Return the price series of a UPC per store within a time window.
+
+    History rows hold the price that was replaced at their timestamp; the
+    store's current price is appended as the last point of each series.
+    """
+    since, until = _window(since, until)
+    params = [upc, since, until]
+    store_filter = ""
+    if store_id is not None:
+        store_filter = "AND ph.store_id = ?"
+        params.append(store_id)
+
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT ph.store_id, ph.timestamp, ph.price
+            FROM items i
+            JOIN price_history ph ON ph.item_id = i.id
+            WHERE i.upc = ? AND ph.timestamp BETWEEN ? AND ? {store_filter}
+            ORDER BY ph.store_id, ph.timestamp
+        """, params)
+        history = cursor.fetchall()
+
+        current_params = [upc]
+        current_filter = ""
+        if store_id is not None:
+            current_filter = "AND si.store_id = ?"
+            current_params.append(store_id)
+        cursor.execute(f"""
+            SELECT si.store_id, si.price
+            FROM items i
+            JOIN store_items si ON si.item_id = i.id
+            WHERE i.upc = ? {current_filter}
+            ORDER BY si.store_id
+        """, current_params)
+        current = cursor.fetchall()
+
+    series = {}
+    for row_store_id, timestamp, price in history:
+        series.setdefault(row_store_id, []).append({"timestamp": timestamp, "price": price})
+    for row_store_id, price in current:
+        series.setdefault(row_store_id, []).append({"timestamp": until, "price": price, "current": True})
+
+    return [{"store_id": key, "points": points} for key, points in sorted(series.items())]
+
+
+def get_price_range(upc, store_id=None, since=None, until=None):
+    """Return the lowest and highest price of a UPC per store within a time window"""
+    since, until = _window(since, until)
+    ranges = {}
+    for entry in get_price_series(upc, store_id, since, until):
+        prices = [point["price"] for point in entry["points"] if point["price"] is not None]
+        if prices:
+            ranges[entry["store_id"]] = {
+                "store_id": entry["store_id"],
+                "min_price": min(prices),
+                "max_price": max(prices),
+                "changes": len(entry["points"]) - 1,
+            }
+    return list(ranges.values())
+
+
+def get_price_drops(since, limit=100):
+    """Return store items whose current price is below their highest price since a time"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ph.store_id, i.upc, i.name, MAX(ph.price) AS high_price, si.price,
+                   MAX(ph.price) - si.price AS price_drop
+            FROM price_history ph
+            JOIN store_items si ON si.store_id = ph.store_id AND si.item_id = ph.item_id
+            JOIN items i ON i.id = ph.item_id
+            WHERE ph.timestamp >= ?
+            GROUP BY ph.store_id, ph.item_id
+            HAVING price_drop > 0
+            ORDER BY price_drop DESC
+            LIMIT ?
+        """, (int(since), limit))
+        rows = cursor.fetchall()
+    return [
+        {"store_id": row[0], "upc": row[1], "name": row[2], "high_price": row[3], "price": row[4], "drop": row[5]}
+        for row in rows
+    ]
+
+
+def compact_price_history(compact_after_days=Config.PRICE_HISTORY_COMPACT_AFTER_DAYS,
+                          bucket_seconds=Config.PRICE_HISTORY_BUCKET_SECONDS,
+                          retention_days=Config.PRICE_HISTORY_RETENTION_DAYS):
+    """Downsample old price changes and drop those past retention.
+
+    Changes older than compact_after_days keep only the lowest and highest
+    price per store, item and bucket, so min/max queries stay exact at
+    bucket resolution. Work is split into bucket-aligned ranges, one
+    transaction each, yielding between them.
+    """
+    now = int(time.time())
+    retention_cutoff = now - retention_days * DAY
+    compact_cutoff = now - compact_after_days * DAY
+    compact_cutoff -= compact_cutoff % bucket_seconds
+    expired = downsampled = 0
+
+    # Expire rows past retention in bounded batches
+    while True:
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM price_history WHERE id IN (
+                    SELECT id FROM price_history WHERE timestamp < ? LIMIT ?
+                )
+            """, (retention_cutoff, Config.MAINTENANCE_BATCH_SIZE))
+            deleted = cursor.rowcount
+            conn.commit()
+        expired += deleted
+        gevent.sleep(0)
+        if deleted < Config.MAINTENANCE_BATCH_SIZE:
+            break
+
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(timestamp) FROM price_history")
+        oldest = cursor.fetchone()[0]
+
+    if oldest is not None:
+        step = bucket_seconds * 30
+        start = oldest - oldest % bucket_seconds
+        while start < compact_cutoff:
+            end = min(start + step, compact_cutoff)
+            with get_db_connection(DATABASE) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM price_history WHERE id IN (
+                        SELECT id FROM (
+                            SELECT id,
+                                   ROW_NUMBER() OVER (PARTITION BY store_id, item_id, timestamp / ?1
+                                                      ORDER BY price ASC, timestamp) AS low_rank,
+                                   ROW_NUMBER() OVER (PARTITION BY store_id, item_id, timestamp / ?1
+                                                      ORDER BY price DESC, timestamp) AS high_rank
+                            FROM price_history
+                            WHERE timestamp >= ?2 AND timestamp < ?3
+                        )
+                        WHERE low_rank > 1 AND high_rank > 1
+                    )
+                """, (bucket_seconds, start, end))
+                downsampled += cursor.rowcount
+                conn.commit()
+            start = end
+            gevent.sleep(0)
+
+    log_message(f"Price history compaction: {expired} expired, {downsampled} downsampled")
+    return {"expired": expired, "downsampled": downsampled}
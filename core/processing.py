@@ -1,262 +1,350 @@
-import json
-import os
-import time
-import grequests
-from gevent.lock import Semaphore
-from gevent.queue import Queue
-from gevent import queue
-import gevent
-from config import Config
-from core.database import get_db_connection
-from utils import log_message
-from flask import Flask
-from enum import IntEnum
-
-
-app = Flask(__name__)
-
-UPCZIP_DB = Config.UPCZIP_DB
-API_URL = Config.API_URL
-DATABASE = Config.DATABASE
-UPLOAD_FOLDER = Config.UPLOAD_FOLDER
-
-
-
-def store_upc_zip(upc, zip_code):
-    """Store the UPC-ZIP combination in the database"""
-    with get_db_connection(UPCZIP_DB) as conn:
-        cursor = conn.cursor()
-        current_time = int(time.time())
-        
-        cursor.execute("""
-            INSERT INTO upczip (upc, zip, timestamp)
-            VALUES (?, ?, ?)
-            ON CONFLICT(upc, zip) DO UPDATE 
-            SET timestamp = excluded.timestamp
-        """, (upc, zip_code, current_time))
-        
-        log_message(f"Stored or updated: UPC {upc}, ZIP {zip_code}")
-        conn.commit()
-
-def process_entry(upc, zip_code):
-    """Process a single UPC-ZIP entry by sending a request and storing data"""
-    if not upc or not zip_code:
-        log_message("Skipping entry with missing UPC or Zipcode")
-        return False
-        
-    store_upc_zip(upc, zip_code)
-    payload = json.dumps({"storeName": "walmart", "upc": upc, "zip": zip_code})
-    headers = {'Content-Type': 'application/json'}
-
-    try:
-        # Using grequests for async requests
-        rs = (grequests.post(API_URL, headers=headers, data=payload))
-        response = grequests.map([rs])[0]
-        response_data = response.json()
-    except (grequests.exceptions.RequestException, json.JSONDecodeError, AttributeError) as e:
-        log_message(f"Error processing {upc}: {str(e)}")
-        return False
-
-    if "stores" not in response_data or "itemDetails" not in response_data:
-        log_message(f"Skipping {upc} due to missing data")
-        log_message(f"Response: {response_data}")
-        return False
-
-    # Database operations
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-
-        # Insert item details
-        item = response_data["itemDetails"]
-        cursor.execute("""
-            INSERT INTO items (name, upc, msrp, image_url, item_url)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(upc) DO UPDATE 
-            SET name=excluded.name, msrp=excluded.msrp, image_url=excluded.image_url, item_url=excluded.item_url
-        """, (item["name"], upc, item.get("msrp"), item.get("imageUrl"), item.get("url")))
-        conn.commit()
-
-        # Get item ID
-        cursor.execute("SELECT id FROM items WHERE upc = ?", (upc,))
-        item_id = cursor.fetchone()[0]
-
-        # Insert store data
-        for store in response_data["stores"]:
-            store_id = int(store["id"])
-            cursor.execute("""
-                INSERT OR IGNORE INTO stores (id, address, city, state, zipcode, motherZip, store_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (store_id, store["address"], store["city"], store["state"], store["zip"], zip_code, store["storeUrl"]))
-
-            # Get current price before updating
-            cursor.execute("SELECT price FROM store_items WHERE store_id = ? AND item_id = ?", (store_id, item_id))
-            current_price_result = cursor.fetchone()
-            
-            # Store new price in history if there was a previous price and it's different
-            if current_price_result and current_price_result[0] != store["price"]:
-                cursor.execute("""
-                    INSERT INTO price_history (store_id, item_id, price, timestamp)
-                    VALUES (?, ?, ?, ?)
-                """, (store_id, item_id, current_price_result[0], int(time.time())))
-
-            cursor.execute("""
-                INSERT INTO store_items (store_id, item_id, price, salesfloor, backroom, aisles)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ON CONFLICT(store_id, item_id) DO UPDATE
-                SET price = excluded.price, salesfloor = excluded.salesfloor, backroom = excluded.backroom, aisles = excluded.aisles
-            """, (store_id, item_id, store["price"], store.get("salesFloor", 0), store.get("backRoom", 0), store.get("aisles", "None")))
-
-        conn.commit()
-    
-    log_message(f"Processed: UPC {upc}, ZIP {zip_code}")
-    return True
-
-
-class Priority(IntEnum):
-    HIGH = 1    # Manual input (higher priority)
-    LOW = 2     # CSV batch processing (lower priority)
-
-# Replace your existing csv_queue with a priority queue
-priority_queue = queue.PriorityQueue()
-processing_worker = None
-csv_processing = False
-
-def start_processing_worker():
-    """Start the background worker greenlet if not already running"""
-    global processing_worker
-    if processing_worker is None or processing_worker.dead:
-        processing_worker = gevent.spawn(queue_worker)
-
-def queue_worker():
-    """Background worker that processes items from the priority queue"""
-    global csv_processing
-    
-    while True:
-        try:
-            # Get item from priority queue (blocks until available)
-            priority, item_type, data = priority_queue.get()
-            
-            if item_type == "manual":
-                upc, zip_code = data
-                log_message(f"Processing HIGH PRIORITY manual entry: UPC {upc}, ZIP {zip_code}")
-                success = process_entry(upc, zip_code)
-                log_message(f"Manual entry processed: {'success' if success else 'failed'}")
-                
-            elif item_type == "csv":
-                if isinstance(data, tuple):
-                    # New format with row tracking
-                    filepath, start_row, total_rows = data
-                    csv_processing = True
-                    log_message(f"Processing CSV file: {filepath}")
-                    process_csv_file(filepath, start_row, total_rows)
-                else:
-                    # Original format (backward compatibility)
-                    filepath = data
-                    csv_processing = True
-                    log_message(f"Processing CSV file: {filepath}")
-                    process_csv_file(filepath)
-                csv_processing = False
-                
-            # gevent.queue doesn't have task_done(), just continue
-            
-        except Exception as e:
-            log_message(f"Error in queue worker: {e}")
-            csv_processing = False
-
-def process_csv_file(filepath, start_row=0, total_original_rows=None):
-    """Process a CSV file row by row, allowing interruption for high priority items"""
-    try:
-        import pandas as pd
-        
-        # Read the CSV/Excel file
-        if filepath.endswith('.xlsx') or filepath.endswith('.xls'):
-            df = pd.read_excel(filepath, engine='openpyxl')
-        else:
-            df = pd.read_csv(filepath)
-        
-        # Calculate total rows for progress tracking
-        if total_original_rows is None:
-            total_original_rows = len(df)
-            current_start = 1
-        else:
-            current_start = start_row + 1
-            
-        log_message(f"Starting CSV processing: {len(df)} rows (rows {current_start}-{start_row + len(df)} of {total_original_rows} total)")
-        
-        for index, row in df.iterrows():
-            # Check if there are higher priority items waiting
-            if not priority_queue.empty():
-                # Peek at the next item to check priority
-                try:
-                    # Create a temporary list to check priorities without consuming items
-                    temp_items = []
-                    has_high_priority = False
-                    
-                    # Check up to 5 items in queue for high priority
-                    for _ in range(min(5, priority_queue.qsize())):
-                        try:
-                            item = priority_queue.get_nowait()
-                            temp_items.append(item)
-                            if item[0] == Priority.HIGH:
-                                has_high_priority = True
-                        except queue.Empty:
-                            break
-                    
-                    # Put items back in queue
-                    for item in temp_items:
-                        priority_queue.put(item)
-                    
-                    if has_high_priority:
-                        log_message("Pausing CSV processing for high priority manual input")
-                        # Re-queue the remaining CSV data
-                        remaining_df = df.iloc[index:]
-                        if len(remaining_df) > 0:
-                            # Preserve original file format
-                            base_name = os.path.splitext(os.path.basename(filepath))[0]
-                            original_ext = os.path.splitext(filepath)[1]
-                            temp_filepath = f"temp_{int(time.time())}_{base_name}{original_ext}"
-                            temp_full_path = os.path.join(UPLOAD_FOLDER, temp_filepath)
-                            
-                            # Save in same format as original
-                            if original_ext.lower() in ['.xlsx', '.xls']:
-                                remaining_df.to_excel(temp_full_path, index=False, engine='openpyxl')
-                            else:
-                                remaining_df.to_csv(temp_full_path, index=False)
-                            
-                            # Calculate the new start row for the remaining data
-                            new_start_row = start_row + index
-                            priority_queue.put((Priority.LOW, "csv", (temp_full_path, new_start_row, total_original_rows)))
-                            log_message(f"Remaining {len(remaining_df)} rows re-queued as {temp_filepath} (continuing from row {new_start_row + 1})")
-                        return  # Exit current CSV processing
-                        
-                except (queue.Empty, IndexError):
-                    pass  # No items or error checking queue
-            
-            # Process current row
-            actual_row_number = start_row + index + 1
-            upc = row.get('upc') or row.get('UPC') or row.get('Upc')
-            zip_code = row.get('zip') or row.get('ZIP') or row.get('Zip')
-            
-            if upc and zip_code:
-                log_message(f"Processing CSV row {actual_row_number}/{total_original_rows}: UPC {upc}, ZIP {zip_code}")
-                success = process_entry(str(upc), str(zip_code))
-                if not success:
-                    log_message(f"Failed to process row {actual_row_number}")
-            else:
-                log_message(f"Skipping row {actual_row_number}/{total_original_rows}: missing UPC or ZIP")
-            
-            # Yield control to allow other greenlets to run
-            gevent.sleep(0.01)
-            
-        log_message(f"Completed CSV processing: {filepath}")
-            
-    except Exception as e:
-        log_message(f"Error processing CSV file {filepath}: {e}")
-    finally:
-        # Clean up temporary file if it exists
-        if os.path.basename(filepath).startswith("temp_"):
-            try:
-                os.remove(filepath)
-                log_message(f"Cleaned up temporary file: {filepath}")
-            except Exception as e:
-                log_message(f"Error cleaning up temp file: {e}")
+import json
+import os
+import time
+from gevent.lock import Semaphore
+from gevent.pool import Pool
+import gevent
+from config import Config
+from core.database import get_db_connection
+from core.writer import batch_writer, response_problem
+from core.upstream import stock_client, record_dead_letter, UpstreamError
+from core.reader import iter_upload_rows, count_rows
+from core.jobs import get_job, update_job, job_queue, JOURNAL_COUNTS
+from core.metrics import Gauge, ingest_rows
+from core.tracing import span
+from utils import log_message, emit_progress
+from flask import Flask
+
+
+app = Flask(__name__)
+
+UPCZIP_DB = Config.UPCZIP_DB
+API_URL = Config.API_URL
+DATABASE = Config.DATABASE
+UPLOAD_FOLDER = Config.UPLOAD_FOLDER
+
+# Greenlet pool bounding how many CSV rows are in flight at once
+ingest_pool = Pool(Config.INGEST_POOL_SIZE)
+
+# Lookup counters across all CSV jobs since startup
+ingest_stats = {"fetched": 0, "skipped_duplicate": 0, "skipped_fresh": 0}
+
+# UPC-ZIP pairs already handled per CSV job, kept across pauses and slices
+job_seen_pairs = {}
+
+# Progress of the CSV job this process is running; empty while idle
+current_job = {}
+
+
+def current_job_progress():
+    """Return row N of M, rate and ETA of the running CSV job, or None"""
+    if not current_job:
+        return None
+    elapsed = time.time() - current_job["started"]
+    rate = (current_job["done"] - current_job["start_row"]) / elapsed if elapsed > 0 else 0.0
+    remaining = max(current_job["total"] - current_job["done"], 0)
+    return {
+        "job_id": current_job["id"],
+        "done": current_job["done"],
+        "total": current_job["total"],
+        "rows_per_second": round(rate, 2),
+        "eta_seconds": round(remaining / rate) if rate > 0 else None,
+    }
+
+def progress_field(name):
+    return lambda: (current_job_progress() or {}).get(name)
+
+def queue_depths():
+    lanes = job_queue.lane_sizes()
+    return {("high",): lanes["manual"], ("low",): lanes["csv"]}
+
+Gauge("ingest_queue_depth", "Jobs waiting to be claimed, by priority", ["priority"], func=queue_depths)
+Gauge("ingest_job_rows_done", "Rows done in the running CSV job", func=progress_field("done"))
+Gauge("ingest_job_rows_total", "Rows in the running CSV job", func=progress_field("total"))
+Gauge("ingest_job_rows_per_second", "Row rate of the running CSV job since it was claimed", func=progress_field("rows_per_second"))
+Gauge("ingest_job_eta_seconds", "Estimated seconds until the running CSV job is done", func=progress_field("eta_seconds"))
+
+
+def store_upc_zip(upc, zip_code):
+    """Queue the UPC-ZIP combination for the next batch write"""
+    batch_writer.add_upczip(upc, zip_code)
+    log_message(f"Stored or updated: UPC {upc}, ZIP {zip_code}", "debug")
+
+def is_fresh(upc, zip_code):
+    """Return True if the UPC-ZIP pair was refreshed within UPCZIP_FRESH_TTL seconds"""
+    if Config.UPCZIP_FRESH_TTL <= 0:
+        return False
+    if (upc, zip_code) in batch_writer.pending_upczip:
+        return True
+    with get_db_connection(UPCZIP_DB) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT timestamp FROM upczip WHERE upc = ? AND zip = ?", (upc, zip_code))
+        row = cursor.fetchone()
+    return row is not None and row[0] >= time.time() - Config.UPCZIP_FRESH_TTL
+
+def process_entry(upc, zip_code):
+    """Process a single UPC-ZIP entry by sending a request and storing data"""
+    if not upc or not zip_code:
+        log_message("Skipping entry with missing UPC or Zipcode")
+        return False
+        
+    # The HTTP, parse and DB write phases have their own spans in
+    # core.upstream and core.writer
+    with span("ingest.entry", upc=upc, zip=zip_code) as attrs:
+        try:
+            # Rate limited, retried and paused by the circuit breaker; see core.upstream
+            response_data = stock_client.fetch(upc, zip_code)
+        except UpstreamError as e:
+            attrs["error"] = "upstream"
+            log_message(f"Error processing {upc} after {e.attempts} attempts: {str(e)}", "error")
+            record_dead_letter(upc, zip_code, str(e), e.attempts)
+            return False
+
+        # One malformed response must not fail the write of its whole batch
+        problem = response_problem(response_data) if isinstance(response_data, dict) else "response is not an object"
+        if problem:
+            attrs["error"] = "malformed"
+            log_message(f"Skipping {upc} due to malformed response: {problem}", "warning")
+            log_message(f"Response: {response_data}", "debug")
+            record_dead_letter(upc, zip_code, f"malformed response: {problem}", 1)
+            return False
+
+        # Database writes are batched; see core.writer. The UPC-ZIP timestamp is
+        # only recorded on success so a failed lookup is never treated as fresh.
+        store_upc_zip(upc, zip_code)
+        batch_writer.add_response(upc, zip_code, response_data)
+    
+    log_message(f"Processed: UPC {upc}, ZIP {zip_code}", "debug")
+    return True
+
+
+def process_csv_row(row_number, upc, zip_code, journal):
+    """Process one CSV row inside the ingest pool"""
+    success = process_entry(upc, zip_code)
+    if success:
+        journal["rows_succeeded"] += 1
+        ingest_rows.inc(result="succeeded")
+    else:
+        journal["rows_failed"] += 1
+        ingest_rows.inc(result="failed")
+        log_message(f"Failed to process row {row_number}", "warning")
+    return success
+
+def new_journal():
+    """Per-run counts of a CSV job, handed to the job queue at each checkpoint"""
+    return dict.fromkeys(JOURNAL_COUNTS, 0) | {"since": time.time()}
+
+def take_journal(journal):
+    """Return the counts and run time since the last checkpoint and start a new interval"""
+    now = time.time()
+    delta = {name: journal[name] for name in JOURNAL_COUNTS}
+    delta["run_seconds"] = now - journal["since"]
+    journal.update(dict.fromkeys(JOURNAL_COUNTS, 0), since=now)
+    return delta
+
+
+processing_worker = None
+heartbeat_worker = None
+csv_processing = False
+
+def start_processing_worker():
+    """Start the background worker greenlets if not already running"""
+    global processing_worker, heartbeat_worker
+    if processing_worker is None or processing_worker.dead:
+        processing_worker = gevent.spawn(queue_worker)
+    if heartbeat_worker is None or heartbeat_worker.dead:
+        heartbeat_worker = gevent.spawn(heartbeat_forever)
+    batch_writer.start()
+
+def heartbeat_forever():
+    """Keep the leases of running jobs alive, even while a job waits on the API"""
+    while True:
+        gevent.sleep(Config.JOB_HEARTBEAT_INTERVAL)
+        try:
+            job_queue.heartbeat()
+        except Exception as e:
+            log_message(f"Error renewing job leases: {e}", "error")
+
+def finish_in_flight():
+    """Wait for the rows in the ingest pool and write them; returns False if the write failed"""
+    ingest_pool.join()
+    return batch_writer.flush()
+
+def release_unwritten(job_id, journal, checkpoint_row):
+    """Give a job back at its last checkpoint after a batch write failed.
+
+    The rows since that checkpoint are dropped from the journal and from the
+    job's seen pairs, so they are looked up again when the job resumes.
+    """
+    log_message(f"Batch write failed; CSV job {job_id} will resume from row {checkpoint_row + 1}", "error")
+    delta = take_journal(journal)
+    job_seen_pairs.pop(job_id, None)
+    job_queue.release(job_id, "paused", {"run_seconds": delta["run_seconds"]}, row_cursor=checkpoint_row)
+    # Back off so a failing database is not retried in a tight loop
+    gevent.sleep(Config.QUEUE_POLL_INTERVAL)
+
+def queue_worker():
+    """Background worker that claims jobs from the durable queue"""
+    global csv_processing
+    
+    while True:
+        job = None
+        try:
+            # Claim the next job, manual entries first (blocks until available)
+            job = job_queue.get()
+            
+            if job["kind"] == "manual":
+                entry = json.loads(job["payload"])
+                upc, zip_code = entry["upc"], entry["zip"]
+                log_message(f"Processing HIGH PRIORITY manual entry: UPC {upc}, ZIP {zip_code}")
+                success = process_entry(upc, zip_code)
+                # Make manual lookups visible right away instead of on the next flush
+                success = batch_writer.flush() and success
+                job_queue.complete_manual(job["id"])
+                log_message(f"Manual entry processed: {'success' if success else 'failed'}")
+                
+            elif job["kind"] == "csv":
+                job_id = job["id"]
+                csv_processing = True
+                log_message(f"Processing CSV job {job_id}")
+                process_csv_file(job_id)
+                csv_processing = False
+                current_job.clear()
+            
+        except Exception as e:
+            log_message(f"Error in queue worker: {e}", "error")
+            csv_processing = False
+            current_job.clear()
+            if job is not None:
+                abandon_job(job)
+            gevent.sleep(Config.QUEUE_POLL_INTERVAL)
+
+def abandon_job(job):
+    """Give up a claimed job after an unexpected error so it does not stay running.
+
+    A CSV job is marked failed at its last checkpoint and a manual entry is
+    dropped. If even that fails, the lease is no longer renewed, so another
+    worker reclaims the job once it expires.
+    """
+    job_id = job["id"]
+    job_seen_pairs.pop(job_id, None)
+    try:
+        if job["kind"] == "manual":
+            job_queue.complete_manual(job_id)
+        else:
+            job_queue.release(job_id, "failed")
+    except Exception as e:
+        log_message(f"Could not release job {job_id}: {e}", "error")
+    finally:
+        job_queue.abandon(job_id)
+
+def process_csv_file(job_id):
+    """Stream a CSV/XLSX job row by row, allowing interruption for high priority items.
+
+    Progress is checkpointed to the job's row_cursor once the rows before it
+    are written, so pausing for a manual entry just saves the cursor and
+    releases the job, and a worker that dies is resumed from its last
+    checkpoint by whichever worker reclaims the lease.
+    """
+    job = get_job(job_id)
+    if job is None:
+        log_message(f"CSV job {job_id} no longer exists")
+        return
+    
+    filepath = job["filepath"]
+    start_row = job["row_cursor"]
+    row_cursor = start_row
+    checkpoint_row = start_row
+    seen_pairs = job_seen_pairs.setdefault(job_id, set())
+    journal = new_journal()
+    
+    try:
+        total_rows = job["total_rows"]
+        if total_rows is None:
+            total_rows = count_rows(filepath)
+            update_job(job_id, total_rows=total_rows)
+            
+        run_started = time.time()
+        current_job.update(id=job_id, total=total_rows, done=start_row, start_row=start_row, started=run_started)
+        action = "Resuming" if start_row else "Starting"
+        log_message(f"{action} CSV processing: {total_rows - start_row} rows (rows {start_row + 1}-{total_rows} of {total_rows} total)")
+        
+        for index, upc, zip_code in iter_upload_rows(filepath, start_row):
+            # Cheap check for manual entries waiting in the high-priority lane
+            if job_queue.has_manual():
+                log_message("Pausing CSV processing for high priority manual input")
+                # Save where we stopped; the job is claimed again ahead of other CSV jobs
+                if not finish_in_flight():
+                    release_unwritten(job_id, journal, checkpoint_row)
+                    return
+                job_queue.release(job_id, "paused", take_journal(journal), row_cursor=index)
+                log_message(f"Remaining {total_rows - index} rows re-queued (continuing from row {index + 1})")
+                return  # Exit current CSV processing
+            
+            # Give other queued uploads a turn once this slice is done
+            if index - start_row >= Config.CSV_SLICE_ROWS and job_queue.has_csv():
+                if not finish_in_flight():
+                    release_unwritten(job_id, journal, checkpoint_row)
+                    return
+                job_queue.release(job_id, "queued", take_journal(journal), row_cursor=index)
+                log_message(f"CSV job {job_id} yielding to other uploads at row {index + 1}/{total_rows}")
+                return
+            
+            # Process current row
+            actual_row_number = index + 1
+            
+            if upc and zip_code:
+                if (upc, zip_code) in seen_pairs:
+                    ingest_stats["skipped_duplicate"] += 1
+                    journal["rows_skipped"] += 1
+                    ingest_rows.inc(result="skipped")
+                    log_message(f"Skipping row {actual_row_number}/{total_rows}: duplicate of an earlier row", "debug")
+                elif is_fresh(upc, zip_code):
+                    seen_pairs.add((upc, zip_code))
+                    ingest_stats["skipped_fresh"] += 1
+                    journal["rows_skipped"] += 1
+                    ingest_rows.inc(result="skipped")
+                    log_message(f"Skipping row {actual_row_number}/{total_rows}: UPC {upc}, ZIP {zip_code} refreshed recently", "debug")
+                else:
+                    seen_pairs.add((upc, zip_code))
+                    ingest_stats["fetched"] += 1
+                    log_message(f"Processing CSV row {actual_row_number}/{total_rows}: UPC {upc}, ZIP {zip_code}", "debug")
+                    # Blocks only while INGEST_POOL_SIZE lookups are already in flight
+                    ingest_pool.spawn(process_csv_row, actual_row_number, upc, zip_code, journal)
+            else:
+                journal["rows_skipped"] += 1
+                ingest_rows.inc(result="skipped")
+                log_message(f"Skipping row {actual_row_number}/{total_rows}: missing UPC or ZIP", "debug")
+            
+            row_cursor = index + 1
+            if row_cursor % Config.JOB_CHECKPOINT_ROWS == 0:
+                # Only checkpoint rows that are safely written; anything after
+                # the cursor is looked up again if the job is resumed elsewhere
+                if not finish_in_flight():
+                    release_unwritten(job_id, journal, checkpoint_row)
+                    return
+                if not job_queue.checkpoint(job_id, take_journal(journal), row_cursor=row_cursor):
+                    log_message(f"CSV job {job_id} was taken over by another worker, stopping at row {row_cursor}", "warning")
+                    job_seen_pairs.pop(job_id, None)
+                    return
+                checkpoint_row = row_cursor
+            current_job["done"] = row_cursor
+            emit_progress(job_id, row_cursor, total_rows, run_started, start_row)
+            
+            # Yield control to allow other greenlets to run
+            gevent.sleep(0)
+        
+        # Wait for the rows still in flight before reporting completion
+        if not finish_in_flight():
+            release_unwritten(job_id, journal, checkpoint_row)
+            return
+        job_queue.release(job_id, "done", take_journal(journal), row_cursor=row_cursor)
+        job_seen_pairs.pop(job_id, None)
+        log_message(f"Completed CSV processing: {filepath} ({len(seen_pairs)} unique UPC-ZIP pairs)")
+            
+    except Exception as e:
+        log_message(f"Error processing CSV file {filepath}: {e}", "error")
+        # Rows after the last checkpoint may not be written, so neither they
+        # nor their counts are recorded
+        job_queue.release(job_id, "failed", {"run_seconds": take_journal(journal)["run_seconds"]}, row_cursor=checkpoint_row)
+        job_seen_pairs.pop(job_id, None)
@@ -0,0 +1,76 @@
+import csv
+import itertools
+
+
+UPC_COLUMNS = ("upc", "UPC", "Upc")
+ZIP_COLUMNS = ("zip", "ZIP", "Zip")
+
+
+def is_excel(filepath):
+    """Return True for spreadsheet uploads"""
+    return filepath.lower().endswith((".xlsx", ".xls"))
+
+
+def cell_to_str(value):
+    """Normalise a CSV/XLSX cell to the string sent to the API"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def find_column(header, names):
+    """Return the index of the first matching column name, or None"""
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def count_rows(filepath):
+    """Count data rows (excluding the header) without loading the file"""
+    if is_excel(filepath):
+        from openpyxl import load_workbook
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            if sheet.max_row:
+                return max(sheet.max_row - 1, 0)
+            return max(sum(1 for _ in sheet.iter_rows(values_only=True)) - 1, 0)
+        finally:
+            workbook.close()
+
+    with open(filepath, "r", encoding="utf-8-sig", newline="") as f:
+        return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+
+def iter_upload_rows(filepath, start_row=0):
+    """Stream (row_index, upc, zip) tuples from a CSV or XLSX upload.
+
+    row_index is the 0-based data row, so passing a saved row cursor as
+    start_row resumes right after the last row handed out. Only the
+    current row is held in memory.
+    """
+    if is_excel(filepath):
+        from openpyxl import load_workbook
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            yield from _iter_rows(rows, start_row)
+        finally:
+            workbook.close()
+    else:
+        with open(filepath, "r", encoding="utf-8-sig", newline="") as f:
+            yield from _iter_rows(csv.reader(f), start_row)
+
+
+def _iter_rows(rows, start_row):
+    header = [cell_to_str(cell) for cell in next(rows, ())]
+    upc_col = find_column(header, UPC_COLUMNS)
+    zip_col = find_column(header, ZIP_COLUMNS)
+
+    for row_index, row in enumerate(itertools.islice(rows, start_row, None), start_row):
+        upc = cell_to_str(row[upc_col]) if upc_col is not None and upc_col < len(row) else ""
+        zip_code = cell_to_str(row[zip_col]) if zip_col is not None and zip_col < len(row) else ""
+        yield row_index, upc, zip_code
@@ -0,0 +1,166 @@
+import time
+import gevent
+from config import Config
+from core.database import get_db_connection, open_dedicated_connection
+from core.cache import bump_data_version
+from utils import log_message
+
+
+DATABASE = Config.DATABASE
+UPCZIP_DB = Config.UPCZIP_DB
+
+# Progress of the current or last retention run, served by /retention_status
+retention_status = {
+    "state": "idle",
+    "days": None,
+    "phase": None,
+    "started_at": None,
+    "finished_at": None,
+    "stale_upcs": 0,
+    "deleted": {},
+    "error": None,
+}
+
+# (status key, batched DELETE). Dependent rows go first and upczip last, so
+# an interrupted run leaves the same UPCs stale and the next run resumes.
+RETENTION_STEPS = [
+    ("store_items", """
+        DELETE FROM main.store_items WHERE rowid IN (
+            SELECT si.rowid FROM retention_items r
+            JOIN main.store_items si ON si.item_id = r.id
+            LIMIT :batch
+        )
+    """),
+    ("price_history", """
+        DELETE FROM main.price_history WHERE id IN (
+            SELECT ph.id FROM retention_items r
+            JOIN main.price_history ph ON ph.item_id = r.id
+            LIMIT :batch
+        )
+    """),
+    ("items", """
+        DELETE FROM main.items WHERE id IN (
+            SELECT i.id FROM retention_items r
+            JOIN main.items i ON i.id = r.id
+            LIMIT :batch
+        )
+    """),
+    ("upczip", """
+        DELETE FROM upczip.upczip WHERE rowid IN (
+            SELECT rowid FROM upczip.upczip WHERE timestamp < :cutoff LIMIT :batch
+        )
+    """),
+]
+
+
+def is_retention_running():
+    return retention_status["state"] == "running"
+
+
+def run_retention(days):
+    """Delete lookups older than days and the items no longer refreshed anywhere.
+
+    An item is removed once no UPC-ZIP pair for its UPC has been refreshed
+    since the cutoff. Deletes run in MAINTENANCE_BATCH_SIZE batches, one
+    short transaction each, sleeping between batches so request greenlets
+    keep running.
+    """
+    cutoff = int(time.time()) - days * 24 * 60 * 60
+    retention_status.update(
+        state="running", days=days, phase="scanning", started_at=int(time.time()),
+        finished_at=None, stale_upcs=0, deleted={key: 0 for key, _ in RETENTION_STEPS}, error=None,
+    )
+    log_message(f"Retention started: removing data older than {days} days")
+
+    conn = open_dedicated_connection(DATABASE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("ATTACH DATABASE ? AS upczip", (UPCZIP_DB,))
+
+        cursor.execute("CREATE TEMP TABLE retention_upcs (upc TEXT PRIMARY KEY)")
+        cursor.execute("""
+            INSERT INTO retention_upcs (upc)
+            SELECT upc FROM upczip.upczip GROUP BY upc HAVING MAX(timestamp) < ?
+        """, (cutoff,))
+        cursor.execute("CREATE TEMP TABLE retention_items (id INTEGER PRIMARY KEY)")
+        cursor.execute("""
+            INSERT INTO retention_items (id)
+            SELECT i.id FROM retention_upcs r JOIN main.items i ON i.upc = r.upc
+        """)
+        conn.commit()
+        retention_status["stale_upcs"] = cursor.execute("SELECT COUNT(*) FROM retention_upcs").fetchone()[0]
+        log_message(f"Retention: {retention_status['stale_upcs']} UPCs not refreshed in {days} days")
+
+        for key, statement in RETENTION_STEPS:
+            retention_status["phase"] = key
+            params = {"cutoff": cutoff, "batch": Config.MAINTENANCE_BATCH_SIZE}
+            while True:
+                with conn:
+                    cursor.execute(statement, params)
+                    deleted = cursor.rowcount
+                    if deleted and key != "upczip":
+                        bump_data_version(cursor)
+                retention_status["deleted"][key] += deleted
+                gevent.sleep(Config.MAINTENANCE_BATCH_PAUSE)
+                if deleted < Config.MAINTENANCE_BATCH_SIZE:
+                    break
+            log_message(f"Retention: deleted {retention_status['deleted'][key]} {key} rows")
+
+        retention_status["phase"] = "optimizing"
+        for schema in ("main", "upczip"):
+            if cursor.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] == 2:
+                # executescript steps the pragma to completion; a plain
+                # execute stops after freeing the first page
+                conn.executescript(f"PRAGMA {schema}.incremental_vacuum")
+            gevent.sleep(Config.MAINTENANCE_BATCH_PAUSE)
+        for table in ("main.store_items", "main.price_history", "main.items", "upczip.upczip"):
+            cursor.execute(f"ANALYZE {table}")
+            gevent.sleep(Config.MAINTENANCE_BATCH_PAUSE)
+
+        retention_status.update(state="done", phase=None, finished_at=int(time.time()))
+        deleted = retention_status["deleted"]
+        log_message(f"Cleared items older than {days} days: {deleted['upczip']} UPC-ZIP combinations, {deleted['items']} items, {deleted['store_items']} store items, {deleted['price_history']} price history records")
+
+    except Exception as e:
+        retention_status.update(state="failed", finished_at=int(time.time()), error=str(e))
+        log_message(f"Error clearing old items: {str(e)}", "error")
+
+    finally:
+        conn.close()
+
+
+def purge_zero_inventory():
+    """Delete store items with no stock on the sales floor or in the back room.
+
+    Searches already hide these rows with a query-time filter; this job only
+    reclaims the space. It walks the table in rowid order in bounded batches
+    so each transaction stays short.
+    """
+    last_rowid = 0
+    purged = 0
+    while True:
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM store_items WHERE rowid IN (
+                    SELECT rowid FROM store_items
+                    WHERE rowid > ? AND salesfloor = 0 AND backroom = 0
+                    ORDER BY rowid
+                    LIMIT ?
+                )
+                RETURNING rowid
+            """, (last_rowid, Config.MAINTENANCE_BATCH_SIZE))
+            deleted = [row[0] for row in cursor.fetchall()]
+            if deleted:
+                bump_data_version(cursor)
+            conn.commit()
+        if not deleted:
+            break
+        purged += len(deleted)
+        last_rowid = max(deleted)
+        gevent.sleep(Config.MAINTENANCE_BATCH_PAUSE)
+        if len(deleted) < Config.MAINTENANCE_BATCH_SIZE:
+            break
+
+    log_message(f"Purged {purged} store items with zero inventory")
+    return purged
@@ -1,255 +1,321 @@
-from core.database import get_db_connection
-from config import Config
-import time
-import sys
-import json
-
-DATABASE = Config.DATABASE
-
-def search_by_zip_upc(upc="", motherzipcode="", city="", state="", price="", deal_filter=False):
-    """Optimized search function with single query and proper indexing"""
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-        
-        # Single optimized query that includes all necessary data in one go
-        if deal_filter:
-            query = """
-            SELECT s.address, s.city, s.state, s.zipcode, s.store_url, 
-                   i.name, i.upc, i.msrp, i.image_url, i.item_url, 
-                   si.price, si.salesfloor, si.backroom, si.aisles,
-                   ump.max_price, ump.description, ump.net, ump.department, ump.productid,
-                   s.id as store_id
-            FROM store_items si
-            JOIN stores s ON si.store_id = s.id 
-            JOIN items i ON si.item_id = i.id
-            JOIN upc_max_prices ump ON i.upc = ump.upc
-            WHERE si.price <= ump.max_price
-            """
-        else:
-            query = """
-            SELECT s.address, s.city, s.state, s.zipcode, s.store_url, 
-                   i.name, i.upc, i.msrp, i.image_url, i.item_url, 
-                   si.price, si.salesfloor, si.backroom, si.aisles,
-                   ump.max_price, ump.description, ump.net, ump.department, ump.productid,
-                   s.id as store_id
-            FROM store_items si
-            JOIN stores s ON si.store_id = s.id 
-            JOIN items i ON si.item_id = i.id
-            LEFT JOIN upc_max_prices ump ON i.upc = ump.upc
-            """
-
-        filters = []
-        params = []
-        
-        # Build filters dynamically
-        if upc:
-            filters.append("i.upc = ?")
-            params.append(upc)
-
-        if motherzipcode:
-            filters.append("s.motherZip = ?")
-            params.append(motherzipcode)
-
-        if city:
-            filters.append("s.city = ?")
-            params.append(city)
-
-        if state:
-            filters.append("s.state = ?")
-            params.append(state)
-
-        if price:
-            filters.append("si.price <= ?")
-            params.append(price)
-            
-        # Add filters to query
-        if filters:
-            if deal_filter:
-                query += " AND " + " AND ".join(filters)
-            else:
-                query += " WHERE " + " AND ".join(filters)
-
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-
-    return results
-
-def get_size_kb(data):
-    """Return the size of an object in kilobytes."""
-    return round(sys.getsizeof(json.dumps(data)) / 1024, 2)  # Convert bytes to KB
-
-def process_zipcode_file(uploaded_file):
-    """
-    Process uploaded CSV or XLSX file and extract zipcodes
-    """
-    try:
-        import pandas as pd
-        
-        print(f"Processing file: {uploaded_file.filename}")
-        
-        # Get file extension
-        filename = uploaded_file.filename.lower()
-        print(f"File extension check: {filename}")
-        
-        # Read file based on extension
-        if filename.endswith('.csv'):
-            print("Reading as CSV...")
-            df = pd.read_csv(uploaded_file)
-        elif filename.endswith(('.xlsx', '.xls')):
-            print("Reading as Excel...")
-            # Read Excel file - use first sheet by default
-            df = pd.read_excel(uploaded_file, engine='openpyxl' if filename.endswith('.xlsx') else 'xlrd')
-        else:
-            print(f"Unsupported file format: {filename}")
-            return None, "Unsupported file format. Please upload a CSV or XLSX file."
-        
-        print(f"File read successfully. Shape: {df.shape}")
-        print(f"Columns: {list(df.columns)}")
-        
-        # Look for zipcode column (flexible naming)
-        zipcode_col = None
-        possible_names = ['zipcode', 'zip', 'postal_code', 'postcode', 'zip_code', 'postal code']
-        
-        for col in df.columns:
-            if col.lower().strip() in possible_names:
-                zipcode_col = col
-                print(f"Found zipcode column: {col}")
-                break
-        
-        if not zipcode_col:
-            print(f"No zipcode column found. Available columns: {list(df.columns)}")
-            return None, f"No zipcode column found. Expected one of: {', '.join(possible_names)}"
-        
-        # Extract zipcodes and clean them properly
-        raw_zipcodes = df[zipcode_col].dropna()
-        print(f"Raw zipcodes before conversion: {raw_zipcodes.head().tolist()}")
-        
-        # Convert to string and handle float values properly
-        zipcodes = []
-        for zipcode in raw_zipcodes:
-            # Convert to string
-            zipcode_str = str(zipcode).strip()
-            
-            # Remove .0 from float values (e.g., "64801.0" -> "64801")
-            if zipcode_str.endswith('.0'):
-                zipcode_str = zipcode_str[:-2]
-            
-            # Only keep non-empty zipcodes
-            if zipcode_str and zipcode_str != 'nan':
-                zipcodes.append(zipcode_str)
-        
-        print(f"Zipcodes after conversion: {zipcodes[:5]}")
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        clean_zipcodes = []
-        for zipcode in zipcodes:
-            if zipcode not in seen:
-                seen.add(zipcode)
-                clean_zipcodes.append(zipcode)
-        
-        print(f"Clean zipcodes: {len(clean_zipcodes)}")
-        print(f"Final sample zipcodes: {clean_zipcodes[:5]}")
-        
-        return clean_zipcodes, None
-        
-    except Exception as e:
-        print(f"Exception in process_zipcode_file: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None, f"Error processing file: {str(e)}"
-
-
-def bulk_search_by_zipcodes(zipcodes, upc="", price="", deal_filter=False, remove_zero_inventory=False):
-    """
-    Optimized bulk search function for multiple zipcodes
-    """
-    if not zipcodes:
-        return []
-    
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-        
-        # Build the base query
-        if deal_filter:
-            query = """
-            SELECT s.address, s.city, s.state, s.zipcode, s.store_url, 
-                   i.name, i.upc, i.msrp, i.image_url, i.item_url, 
-                   si.price, si.salesfloor, si.backroom, si.aisles,
-                   ump.max_price, ump.description, ump.net, ump.department, ump.productid,
-                   s.id as store_id
-            FROM store_items si
-            JOIN stores s ON si.store_id = s.id 
-            JOIN items i ON si.item_id = i.id
-            JOIN upc_max_prices ump ON i.upc = ump.upc
-            WHERE si.price <= ump.max_price
-            """
-        else:
-            query = """
-            SELECT s.address, s.city, s.state, s.zipcode, s.store_url, 
-                   i.name, i.upc, i.msrp, i.image_url, i.item_url, 
-                   si.price, si.salesfloor, si.backroom, si.aisles,
-                   ump.max_price, ump.description, ump.net, ump.department, ump.productid,
-                   s.id as store_id
-            FROM store_items si
-            JOIN stores s ON si.store_id = s.id 
-            JOIN items i ON si.item_id = i.id
-            LEFT JOIN upc_max_prices ump ON i.upc = ump.upc
-            WHERE 1=1
-            """
-
-        filters = []
-        params = []
-        
-        # Add zipcode filter using IN clause for efficiency
-        zipcode_placeholders = ','.join(['?' for _ in zipcodes])
-        filters.append(f"s.motherZip IN ({zipcode_placeholders})")
-        params.extend(zipcodes)
-
-        # Add optional filters
-        if upc:
-            filters.append("i.upc = ?")
-            params.append(upc)
-
-        if price:
-            filters.append("si.price <= ?")
-            params.append(price)
-            
-        if remove_zero_inventory:
-            filters.append("(si.salesfloor > 0 OR si.backroom > 0)")
-            
-        # Add filters to query
-        if filters:
-            if deal_filter:
-                query += " AND " + " AND ".join(filters)
-            else:
-                query += " AND " + " AND ".join(filters)
-
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-
-    return results
-
-
-def bulk_search_by_zipcodes_chunked(zipcodes, upc="", price="", deal_filter=False, remove_zero_inventory=False, chunk_size=100):
-    """
-    Chunked version for handling large numbers of zipcodes
-    """
-    if not zipcodes:
-        return []
-    
-    all_results = []
-    
-    # Process zipcodes in chunks to avoid SQL parameter limits
-    for i in range(0, len(zipcodes), chunk_size):
-        chunk = zipcodes[i:i + chunk_size]
-        chunk_results = bulk_search_by_zipcodes(
-            zipcodes=chunk,
-            upc=upc,
-            price=price,
-            deal_filter=deal_filter,
-            remove_zero_inventory=remove_zero_inventory
-        )
-        all_results.extend(chunk_results)
-    
-    return all_results
\ No newline at end of file
+from core.database import get_db_connection
+from core.cache import search_cache, get_data_version
+from core.tracing import span
+from utils import log_message
+from config import Config
+import time
+import sys
+import json
+
+DATABASE = Config.DATABASE
+
+def fetch_rows(cursor, size=Config.EXPORT_FETCH_SIZE):
+    """Yield rows from an executed cursor in fetchmany-sized chunks"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+SEARCH_COLUMNS = """
+    s.address, s.city, s.state, s.zipcode, s.store_url,
+    i.name, i.upc, i.msrp, i.image_url, i.item_url,
+    si.price, si.salesfloor, si.backroom, si.aisles,
+    ump.max_price, ump.description, ump.net, ump.department, ump.productid,
+    s.id as store_id
+"""
+
+def build_search_query(upc="", motherzipcode="", city="", state="", price=None, deal_filter=False,
+                       remove_zero_inventory=False, zip_table=None, columns=SEARCH_COLUMNS, extra_filters=()):
+    """Return (sql, params) for a store item search.
+
+    zip_table names a temp table of zipcodes joined on stores.motherZip, as
+    used by bulk search. extra_filters is a list of (condition, params)
+    added to the WHERE clause. The index set in core.database.create_indexes
+    is tuned to the plans of these queries; benchmarks.query_plans records them.
+    """
+    if zip_table:
+        query = f"SELECT {columns} FROM {zip_table} sz JOIN stores s ON s.motherZip = sz.zip"
+    else:
+        query = f"SELECT {columns} FROM stores s"
+    query += """
+        JOIN store_items si ON si.store_id = s.id
+        JOIN items i ON i.id = si.item_id
+    """
+    if deal_filter:
+        # Deals are materialized by triggers; see core.database.create_deals_table
+        query += """
+        JOIN deals d ON d.store_id = si.store_id AND d.item_id = si.item_id
+        JOIN upc_max_prices ump ON ump.upc = i.upc
+        """
+    else:
+        query += """
+        LEFT JOIN upc_max_prices ump ON ump.upc = i.upc
+        """
+
+    filters = []
+    params = []
+
+    if upc:
+        filters.append("i.upc = ?")
+        params.append(upc)
+
+    if motherzipcode:
+        filters.append("s.motherZip = ?")
+        params.append(motherzipcode)
+
+    if city:
+        filters.append("s.city = ?")
+        params.append(city)
+
+    if state:
+        filters.append("s.state = ?")
+        params.append(state)
+
+    if price is not None:
+        filters.append("si.price <= ?")
+        params.append(price)
+
+    if remove_zero_inventory:
+        # Matches the partial index idx_store_items_in_stock
+        filters.append("(si.salesfloor > 0 OR si.backroom > 0)")
+
+    for condition, condition_params in extra_filters:
+        filters.append(condition)
+        params.extend(condition_params)
+
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    return query, params
+
+def search_by_zip_upc(upc="", motherzipcode="", city="", state="", price=None, deal_filter=False, remove_zero_inventory=False):
+    """Optimized search function with single query and proper indexing"""
+    return list(iter_search_by_zip_upc(upc, motherzipcode, city, state, price, deal_filter, remove_zero_inventory))
+
+def iter_search_by_zip_upc(upc="", motherzipcode="", city="", state="", price=None, deal_filter=False, remove_zero_inventory=False):
+    """Streaming version of search_by_zip_upc that yields rows as they are read"""
+    key = (upc or "", motherzipcode or "", city or "", state or "", "" if price is None else str(price), bool(deal_filter), bool(remove_zero_inventory))
+    # Read the version before querying so a write landing mid-search
+    # leaves the cached copy already stale rather than wrongly fresh.
+    version = get_data_version()
+    with span("search", upc=upc, zipcode=motherzipcode, city=city, state=state, deal_filter=bool(deal_filter)) as attrs:
+        rows = search_cache.get(key, version)
+        attrs["cached"] = rows is not None
+        if rows is not None:
+            attrs["rows"] = len(rows)
+            yield from rows
+            return
+
+        collected = []
+        count = 0
+        for row in query_search_by_zip_upc(upc, motherzipcode, city, state, price, deal_filter, remove_zero_inventory):
+            yield row
+            count += 1
+            if collected is not None:
+                collected.append(row)
+                if len(collected) > Config.SEARCH_CACHE_MAX_ROWS:
+                    collected = None
+        attrs["rows"] = count
+        if collected is not None:
+            search_cache.put(key, version, collected)
+
+def query_search_by_zip_upc(upc="", motherzipcode="", city="", state="", price=None, deal_filter=False, remove_zero_inventory=False):
+    """Run the search query directly against the database, bypassing the cache"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        
+        query, params = build_search_query(upc, motherzipcode, city, state, price, deal_filter, remove_zero_inventory)
+        cursor.execute(query, params)
+        yield from fetch_rows(cursor)
+
+def get_size_kb(data):
+    """Return the size of an object in kilobytes."""
+    return round(sys.getsizeof(json.dumps(data)) / 1024, 2)  # Convert bytes to KB
+
+def process_zipcode_file(uploaded_file):
+    """
+    Process uploaded CSV or XLSX file and extract zipcodes
+    """
+    try:
+        import pandas as pd
+        
+        # Get file extension
+        filename = uploaded_file.filename.lower()
+        
+        # Read file based on extension
+        if filename.endswith('.csv'):
+            df = pd.read_csv(uploaded_file)
+        elif filename.endswith(('.xlsx', '.xls')):
+            # Read Excel file - use first sheet by default
+            df = pd.read_excel(uploaded_file, engine='openpyxl' if filename.endswith('.xlsx') else 'xlrd')
+        else:
+            return None, "Unsupported file format. Please upload a CSV or XLSX file."
+        
+        # Look for zipcode column (flexible naming)
+        zipcode_col = None
+        possible_names = ['zipcode', 'zip', 'postal_code', 'postcode', 'zip_code', 'postal code']
+        
+        for col in df.columns:
+            if col.lower().strip() in possible_names:
+                zipcode_col = col
+                break
+        
+        if not zipcode_col:
+            return None, f"No zipcode column found. Expected one of: {', '.join(possible_names)}"
+        
+        # Extract zipcodes and clean them properly
+        raw_zipcodes = df[zipcode_col].dropna()
+        
+        # Convert to string and handle float values properly
+        zipcodes = []
+        for zipcode in raw_zipcodes:
+            # Convert to string
+            zipcode_str = str(zipcode).strip()
+            
+            # Remove .0 from float values (e.g., "64801.0" -> "64801")
+            if zipcode_str.endswith('.0'):
+                zipcode_str = zipcode_str[:-2]
+            
+            # Only keep non-empty zipcodes
+            if zipcode_str and zipcode_str != 'nan':
+                zipcodes.append(zipcode_str)
+        
+        # Remove duplicates while preserving order
+        seen = set()
+        clean_zipcodes = []
+        for zipcode in zipcodes:
+            if zipcode not in seen:
+                seen.add(zipcode)
+                clean_zipcodes.append(zipcode)
+        
+        log_message(f"Read {len(clean_zipcodes)} unique zipcodes from {uploaded_file.filename}", "debug")
+        return clean_zipcodes, None
+        
+    except Exception as e:
+        log_message(f"Error reading zipcode file {uploaded_file.filename}: {e}", "error")
+        return None, f"Error processing file: {str(e)}"
+
+
+def bulk_search_by_zipcodes(zipcodes, upc="", price=None, deal_filter=False, remove_zero_inventory=False):
+    """
+    Optimized bulk search function for multiple zipcodes
+    """
+    return list(iter_bulk_search_by_zipcodes(zipcodes, upc, price, deal_filter, remove_zero_inventory))
+
+
+def load_search_zipcodes(cursor, zipcodes):
+    """Fill the search_zipcodes temp table joined by zip_table searches.
+
+    Loading the zipcodes into an indexed temp table lets a whole upload be
+    answered by one join instead of one query per chunk of zipcodes. Temp
+    tables live on the connection, so any earlier search is cleared out.
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS search_zipcodes (zip TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM search_zipcodes")
+    cursor.executemany("INSERT OR IGNORE INTO search_zipcodes (zip) VALUES (?)", ((zipcode,) for zipcode in zipcodes))
+
+
+def iter_bulk_search_by_zipcodes(zipcodes, upc="", price=None, deal_filter=False, remove_zero_inventory=False):
+    """
+    Streaming version of bulk_search_by_zipcodes that yields rows as they are read
+    """
+    if not zipcodes:
+        return
+    
+    with span("search.bulk", zipcodes=len(zipcodes), upc=upc, deal_filter=bool(deal_filter)) as attrs, get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        
+        load_search_zipcodes(cursor, zipcodes)
+        
+        query, params = build_search_query(
+            upc=upc, price=price, deal_filter=deal_filter,
+            remove_zero_inventory=remove_zero_inventory, zip_table="search_zipcodes"
+        )
+        cursor.execute(query, params)
+        attrs["rows"] = 0
+        for row in fetch_rows(cursor):
+            yield row
+            attrs["rows"] += 1
+        
+        cursor.execute("DELETE FROM search_zipcodes")
+
+
+# Fields of a search page; each maps to the SQL it is selected as
+PAGE_FIELDS = {
+    "store_id": "si.store_id",
+    "item_id": "si.item_id",
+    "address": "s.address",
+    "city": "s.city",
+    "state": "s.state",
+    "zipcode": "s.zipcode",
+    "store_url": "s.store_url",
+    "upc": "i.upc",
+    "name": "i.name",
+    "msrp": "i.msrp",
+    "image_url": "i.image_url",
+    "item_url": "i.item_url",
+    "price": "si.price",
+    "salesfloor": "si.salesfloor",
+    "backroom": "si.backroom",
+    "aisles": "si.aisles",
+    "max_price": "ump.max_price",
+    "margin": "ump.max_price - si.price",
+    "description": "ump.description",
+    "net": "ump.net",
+    "department": "ump.department",
+    "productid": "ump.productid",
+}
+
+PAGE_SORTS = ("store", "price", "margin")
+
+
+def search_page(fields, sort="store", descending=False, limit=100, after=None, zipcodes=None,
+                upc="", motherzipcode="", city="", state="", price=None, deal_filter=False, remove_zero_inventory=False):
+    """Return (rows, next_key) for one page of a search, keyset-paginated.
+
+    Rows are ordered by (sort value, store_id, item_id) and hold the
+    requested fields; after is the next_key of the previous page. Sorting by
+    price or margin leaves out rows where that value is NULL, so margin
+    pages only contain items with a max price.
+    """
+    sort_expr = {"price": "si.price", "margin": "d.margin" if deal_filter else "ump.max_price - si.price"}.get(sort)
+    # s.id rather than si.store_id lets store-ordered pages walk stores by
+    # rowid (or the motherZip index) without sorting
+    key_exprs = ([sort_expr] if sort_expr else []) + ["s.id", "si.item_id"]
+    comparison = "<" if descending else ">"
+    direction = "DESC" if descending else "ASC"
+
+    extra_filters = []
+    if sort_expr:
+        extra_filters.append((f"{sort_expr} IS NOT NULL", []))
+    if after:
+        key_list = ", ".join(key_exprs)
+        # The single-column bound lets SQLite seek an index on the leading
+        # key; the row-value comparison resumes exactly after the last row
+        extra_filters.append((f"{key_exprs[0]} {comparison}= ? AND ({key_list}) {comparison} ({', '.join('?' * len(key_exprs))})",
+                              [after[0], *after]))
+
+    columns = ", ".join([PAGE_FIELDS[field] for field in fields] + key_exprs)
+    query, params = build_search_query(
+        upc, motherzipcode, city, state, price, deal_filter, remove_zero_inventory,
+        zip_table="search_zipcodes" if zipcodes else None, columns=columns, extra_filters=extra_filters
+    )
+    query += " ORDER BY " + ", ".join(f"{expr} {direction}" for expr in key_exprs) + " LIMIT ?"
+    params.append(limit + 1)
+
+    with span("search.page", sort=sort, limit=limit, upc=upc, zipcode=motherzipcode, zipcodes=len(zipcodes or ())) as attrs, get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        if zipcodes:
+            load_search_zipcodes(cursor, zipcodes)
+        cursor.execute(query, params)
+        # Fetch one extra row to know whether another page follows
+        results = cursor.fetchall()
+        if zipcodes:
+            cursor.execute("DELETE FROM search_zipcodes")
+        attrs["rows"] = len(results)
+
+    next_key = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_key = list(results[-1][len(fields):])
+    return [row[:len(fields)] for row in results], next_key
@@ -0,0 +1,119 @@
+import cProfile
+import io
+import pstats
+import re
+import sqlite3
+import time
+from collections import deque
+from contextlib import contextmanager
+import gevent
+from config import Config
+from core.metrics import Histogram
+from utils import log_message
+
+
+span_latency = Histogram("span_seconds", "Duration of traced spans", ["span"])
+
+# Most recent spans, newest last, for /trace_spans
+recent_spans = deque(maxlen=Config.TRACE_BUFFER_SIZE)
+
+profile_status = {"running": False, "started_at": None, "seconds": None}
+
+
+def record_span(name, duration, **attrs):
+    """Record a finished span in the recent buffer and the span histogram"""
+    span_latency.observe(duration, span=name)
+    recent_spans.append(dict(attrs, name=name, start=round(time.time() - duration, 3), duration_ms=round(duration * 1000, 3)))
+    if Config.TRACE_SLOW_SPAN_SECONDS is not None and duration >= Config.TRACE_SLOW_SPAN_SECONDS:
+        log_message(f"Slow {name}: {duration:.2f}s {attrs}", "warning")
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a with-block as a span; the yielded dict can be filled with attributes.
+
+    Spans are flat rather than nested, so one may wrap the body of a
+    generator and then also covers the time its consumer spends between rows.
+    """
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            attrs["error"] = type(e).__name__
+        raise
+    finally:
+        record_span(name, time.perf_counter() - started, **attrs)
+
+
+def get_recent_spans(name=None, limit=100):
+    """Return up to limit recent spans, newest first, optionally only those called name"""
+    spans = [s for s in reversed(recent_spans) if name is None or s["name"] == name]
+    return spans[:limit]
+
+
+def profile(seconds, sort="cumulative", limit=50):
+    """Profile the whole process for a few seconds and return the pstats report.
+
+    Every greenlet runs on the main thread, so enabling cProfile here and
+    sleeping lets it sample whatever the server does in the meantime.
+    """
+    profiler = cProfile.Profile()
+    profile_status.update(running=True, started_at=int(time.time()), seconds=seconds)
+    try:
+        profiler.enable()
+        gevent.sleep(seconds)
+        profiler.disable()
+    finally:
+        profile_status["running"] = False
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+def log_slow_query(started, sql, parameters):
+    elapsed = time.perf_counter() - started
+    if elapsed >= Config.SLOW_QUERY_SECONDS:
+        statement = re.sub(r"\s+", " ", sql).strip()
+        log_message(f"Slow query ({elapsed:.3f}s): {statement} params={parameters!r:.500}", "warning")
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that logs statements slower than SLOW_QUERY_SECONDS with their parameters"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            log_slow_query(started, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            log_slow_query(started, sql, f"<{self.rowcount} rows>")
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            log_slow_query(started, sql_script, ())
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection factory whose cursors, including those of conn.execute, are traced"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
@@ -0,0 +1,198 @@
+import json
+import random
+import time
+import gevent
+from gevent.event import Event
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from config import Config
+from core.database import get_db_connection
+from core.metrics import upstream_latency
+from core.tracing import span
+from utils import log_message
+
+
+DATABASE = Config.DATABASE
+
+
+class UpstreamError(Exception):
+    """Raised when a stock lookup fails after every retry"""
+
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+class TokenBucket:
+    """Token-bucket rate limiter; acquire() sleeps the greenlet until a token is free"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            gevent.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Stops calling the API after repeated failures and probes again after a cool-down"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_finished = Event()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def wait(self):
+        """Block while the breaker is open; returns True if the caller is to send the probe.
+
+        Only one caller probes a half-open breaker; the others keep waiting
+        until the probe closes the breaker or opens it again.
+        """
+        while True:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "open":
+                gevent.sleep(self.reset_timeout - (time.monotonic() - self.opened_at))
+            elif not self.probing:
+                self.probing = True
+                self.probe_finished.clear()
+                return True
+            else:
+                self.probe_finished.wait()
+
+    def end_probe(self):
+        """Let the next waiting caller probe, or all of them through if the breaker closed"""
+        self.probing = False
+        self.probe_finished.set()
+
+    def record_success(self):
+        if self.opened_at is not None:
+            log_message("Stock API recovered, resuming lookups")
+        self.failures = 0
+        self.opened_at = None
+        self.end_probe()
+
+    def record_failure(self, probe=False):
+        self.failures += 1
+        if self.state == "half_open" or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            log_message(f"Stock API failing ({self.failures} errors in a row), pausing lookups for {self.reset_timeout}s", "warning")
+        if probe:
+            self.end_probe()
+
+
+class StockClient:
+    """Client for the stock API with rate limiting, timeouts, retries and a circuit breaker"""
+
+    def __init__(self, url=Config.API_URL):
+        self.url = url
+        # Shared session so lookups reuse keep-alive connections; pool_block
+        # caps the number of simultaneous connections to the API host.
+        self.session = Session()
+        for prefix in ("http://", "https://"):
+            self.session.mount(prefix, HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=Config.API_MAX_CONNECTIONS_PER_HOST,
+                pool_block=True,
+            ))
+        self.bucket = TokenBucket(Config.API_RATE_LIMIT, Config.API_RATE_BURST)
+        self.breaker = CircuitBreaker(Config.API_BREAKER_THRESHOLD, Config.API_BREAKER_RESET)
+
+    def fetch(self, upc, zip_code):
+        """Return the parsed API response for a UPC-ZIP pair or raise UpstreamError"""
+        payload = json.dumps({"storeName": "walmart", "upc": upc, "zip": zip_code})
+        headers = {'Content-Type': 'application/json'}
+        last_error = None
+        attempt = 0
+
+        while attempt < Config.API_MAX_ATTEMPTS:
+            # Probes made while the API is known to be down do not use up this
+            # lookup's attempts, so an outage pauses rows instead of losing them.
+            probing = self.breaker.wait()
+            if not probing:
+                attempt += 1
+            try:
+                self.bucket.acquire()
+                started = time.perf_counter()
+                with span("ingest.http", upc=upc, zip=zip_code, attempt=attempt) as attrs:
+                    response = self.session.post(
+                        self.url, headers=headers, data=payload,
+                        timeout=(Config.API_CONNECT_TIMEOUT, Config.API_READ_TIMEOUT),
+                    )
+                    attrs["status"] = response.status_code
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise RequestException(f"HTTP {response.status_code}")
+                with span("ingest.parse", upc=upc, bytes=len(response.content)):
+                    data = response.json()
+            except (RequestException, json.JSONDecodeError) as e:
+                upstream_latency.observe(time.perf_counter() - started, outcome="error")
+                self.breaker.record_failure(probing)
+                last_error = e
+                if attempt < Config.API_MAX_ATTEMPTS:
+                    # Full jitter keeps retrying greenlets from stampeding together
+                    backoff = min(Config.API_BACKOFF_MAX, Config.API_BACKOFF_BASE * 2 ** max(attempt - 1, 0))
+                    gevent.sleep(random.uniform(0, backoff))
+                continue
+            except BaseException:
+                # A probe that ends any other way must not leave the others waiting
+                if probing:
+                    self.breaker.end_probe()
+                raise
+
+            upstream_latency.observe(time.perf_counter() - started, outcome="ok")
+            self.breaker.record_success()
+            return data
+
+        raise UpstreamError(str(last_error), Config.API_MAX_ATTEMPTS)
+
+
+def record_dead_letter(upc, zip_code, error, attempts):
+    """Keep a lookup that exhausted its retries so it can be inspected or re-run"""
+    with get_db_connection(DATABASE) as conn:
+        conn.execute("""
+            INSERT INTO dead_letters (upc, zip, error, attempts, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (upc, zip_code, error, attempts, int(time.time())))
+        conn.commit()
+
+
+def get_dead_letters(limit=100):
+    """Return the most recent dead-lettered lookups"""
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, upc, zip, error, attempts, created_at
+            FROM dead_letters
+            ORDER BY id DESC
+            LIMIT ?
+        """, (limit,))
+        rows = cursor.fetchall()
+    return [
+        {"id": row[0], "upc": row[1], "zip": row[2], "error": row[3], "attempts": row[4], "created_at": row[5]}
+        for row in rows
+    ]
+
+
+stock_client = StockClient()
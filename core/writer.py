@@ -0,0 +1,207 @@
+import time
+import gevent
+from gevent.lock import Semaphore
+from config import Config
+from core.database import get_db_connection
+from core.cache import bump_data_version, location_index
+from core.metrics import db_write_latency, db_write_rows
+from core.tracing import span
+from core.upstream import record_dead_letter
+from utils import log_message
+
+
+DATABASE = Config.DATABASE
+UPCZIP_DB = Config.UPCZIP_DB
+
+# Fields _write_responses reads without a default
+REQUIRED_ITEM_KEYS = ("name",)
+REQUIRED_STORE_KEYS = ("id", "address", "city", "state", "zip", "storeUrl", "price")
+
+
+def response_problem(response_data):
+    """Return why an API response cannot be written, or None if it can"""
+    item = response_data.get("itemDetails")
+    stores = response_data.get("stores")
+    if not isinstance(item, dict) or not isinstance(stores, list):
+        return "missing itemDetails or stores"
+    missing = [key for key in REQUIRED_ITEM_KEYS if key not in item]
+    if missing:
+        return f"itemDetails without {', '.join(missing)}"
+    for store in stores:
+        if not isinstance(store, dict):
+            return "store entry is not an object"
+        missing = [key for key in REQUIRED_STORE_KEYS if key not in store]
+        if missing:
+            return f"store without {', '.join(missing)}"
+        try:
+            int(store["id"])
+        except (TypeError, ValueError):
+            return f"store id {store['id']!r} is not a number"
+    return None
+
+
+class BatchWriter:
+    """Write-behind buffer for ingested API responses.
+
+    Responses and UPC-ZIP timestamps are collected in memory and written with
+    executemany in a single transaction per database, either when the buffer
+    reaches WRITE_BATCH_SIZE responses or every WRITE_FLUSH_INTERVAL seconds.
+    A batch whose write fails stays buffered for the next flush; after
+    WRITE_MAX_ATTEMPTS failures its responses are dead-lettered.
+    """
+
+    def __init__(self, batch_size=Config.WRITE_BATCH_SIZE, flush_interval=Config.WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending_responses = []
+        self.pending_upczip = {}
+        self.flush_lock = Semaphore()
+        self.flusher = None
+        self.failed_attempts = 0
+
+    def start(self):
+        """Start the periodic flusher greenlet if not already running"""
+        if self.flusher is None or self.flusher.dead:
+            self.flusher = gevent.spawn(self._flush_loop)
+
+    def _flush_loop(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            self.flush()
+
+    def add_upczip(self, upc, zip_code):
+        """Record that a UPC-ZIP pair was looked up now"""
+        self.pending_upczip[(upc, zip_code)] = int(time.time())
+
+    def add_response(self, upc, zip_code, response_data):
+        """Buffer a parsed API response, flushing when the batch is full"""
+        self.pending_responses.append((upc, zip_code, response_data))
+        if len(self.pending_responses) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self.flush_lock:
+            # Swap the buffers out before touching the database so greenlets
+            # adding rows meanwhile start a fresh batch.
+            responses, self.pending_responses = self.pending_responses, []
+            upczip, self.pending_upczip = self.pending_upczip, {}
+
+            try:
+                if upczip or responses:
+                    with span("ingest.db_write", responses=len(responses), upczip=len(upczip)):
+                        # Responses first: a UPC-ZIP timestamp marks the pair
+                        # fresh, so it must not land without its data
+                        if responses:
+                            with db_write_latency.time(target="responses"):
+                                self._write_responses(responses)
+                            db_write_rows.inc(len(responses), target="responses")
+                        if upczip:
+                            with db_write_latency.time(target="upczip"):
+                                self._write_upczip(upczip)
+                            db_write_rows.inc(len(upczip), target="upczip")
+            except Exception as e:
+                self.failed_attempts += 1
+                log_message(f"Error writing batch of {len(responses)} responses (attempt {self.failed_attempts}): {e}", "error")
+                self._requeue(responses, upczip, e)
+                return False
+            self.failed_attempts = 0
+
+        if upczip or responses:
+            log_message(f"Flushed batch: {len(responses)} responses, {len(upczip)} UPC-ZIP pairs", "debug")
+        return True
+
+    def _requeue(self, responses, upczip, error):
+        """Put a failed batch back in front of the buffer, or dead-letter it after WRITE_MAX_ATTEMPTS"""
+        if self.failed_attempts >= Config.WRITE_MAX_ATTEMPTS:
+            log_message(f"Giving up on batch of {len(responses)} responses after {self.failed_attempts} attempts", "error")
+            self.failed_attempts = 0
+            for upc, zip_code, _ in responses:
+                try:
+                    record_dead_letter(upc, zip_code, f"batch write failed: {error}", Config.WRITE_MAX_ATTEMPTS)
+                except Exception as e:
+                    log_message(f"Error recording dead letter for {upc}, {zip_code}: {e}", "error")
+                # Not fresh: the pair is looked up again the next time it is seen
+                upczip.pop((upc, zip_code), None)
+            responses = []
+        self.pending_responses = responses + self.pending_responses
+        self.pending_upczip = {**upczip, **self.pending_upczip}
+
+    def _write_upczip(self, upczip):
+        with get_db_connection(UPCZIP_DB) as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO upczip (upc, zip, timestamp)
+                VALUES (?, ?, ?)
+                ON CONFLICT(upc, zip) DO UPDATE
+                SET timestamp = excluded.timestamp
+            """, [(upc, zip_code, ts) for (upc, zip_code), ts in upczip.items()])
+            conn.commit()
+
+    def _write_responses(self, responses):
+        now = int(time.time())
+
+        # Collapse duplicates within the batch; the latest response wins
+        items = {}
+        for upc, zip_code, response_data in responses:
+            item = response_data["itemDetails"]
+            items[upc] = (item["name"], upc, item.get("msrp"), item.get("imageUrl"), item.get("url"))
+
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+
+            cursor.executemany("""
+                INSERT INTO items (name, upc, msrp, image_url, item_url)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(upc) DO UPDATE
+                SET name=excluded.name, msrp=excluded.msrp, image_url=excluded.image_url, item_url=excluded.item_url
+            """, list(items.values()))
+
+            item_ids = {}
+            for upc in items:
+                cursor.execute("SELECT id FROM items WHERE upc = ?", (upc,))
+                item_ids[upc] = cursor.fetchone()[0]
+
+            stores = []
+            store_items = {}
+            for upc, zip_code, response_data in responses:
+                item_id = item_ids[upc]
+                for store in response_data["stores"]:
+                    store_id = int(store["id"])
+                    stores.append((store_id, store["address"], store["city"], store["state"], store["zip"], zip_code, store["storeUrl"]))
+                    store_items[(store_id, item_id)] = (
+                        store_id, item_id, store["price"],
+                        store.get("salesFloor", 0), store.get("backRoom", 0), store.get("aisles", "None")
+                    )
+
+            cursor.executemany("""
+                INSERT OR IGNORE INTO stores (id, address, city, state, zipcode, motherZip, store_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, stores)
+            new_stores = cursor.rowcount
+
+            # Keep the previous price in history when it changes; must run
+            # before the upsert below overwrites it.
+            cursor.executemany("""
+                INSERT INTO price_history (store_id, item_id, price, timestamp)
+                SELECT store_id, item_id, price, ?
+                FROM store_items
+                WHERE store_id = ? AND item_id = ? AND price IS NOT ?
+            """, [(now, row[0], row[1], row[2]) for row in store_items.values()])
+
+            cursor.executemany("""
+                INSERT INTO store_items (store_id, item_id, price, salesfloor, backroom, aisles)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(store_id, item_id) DO UPDATE
+                SET price = excluded.price, salesfloor = excluded.salesfloor, backroom = excluded.backroom, aisles = excluded.aisles
+            """, list(store_items.values()))
+
+            bump_data_version(cursor)
+            conn.commit()
+
+        # Only a new store can add a state or city to the dropdowns
+        if new_stores > 0:
+            location_index.invalidate()
+
+
+batch_writer = BatchWriter()
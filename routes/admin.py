@@ -1,100 +1,180 @@
-from flask import Blueprint, request, jsonify ,render_template,session
-from core.processing import csv_processing,priority_queue,start_processing_worker,Priority,processing_worker
-from utils import log_message
-from config import Config
-import os
-from gevent import queue
-
-
-
-UPLOAD_FOLDER = Config.UPLOAD_FOLDER
-bp = Blueprint('admin', __name__)
-
-@bp.route("/adminpanel")
-def admin():
-    """Admin panel route"""
-    return render_template("admin.html")
-
-@bp.route('/clear_logs', methods=['POST'])
-def clear_logs():
-    if 'logs' in session:
-        session.pop('logs')  # Remove only logs (keeps other session data)
-        session.modified = True  # Force save
-        return jsonify({"message": "Logs cleared successfully"})
-    return jsonify({"message": "No logs to clear"}), 404
-
-@bp.route("/upload_csv", methods=["POST"])
-def upload_csv():
-    """Handle CSV file upload and process each entry"""
-    try:
-        if "file" not in request.files:
-            return jsonify({"message": "No file provided"}), 400
-
-        file = request.files["file"]
-        if file.filename == "":
-            return jsonify({"message": "No selected file"}), 400
-
-        filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(filepath)
-        log_message(f"CSV uploaded. Adding to processing queue... {filepath}")
-
-        # Add CSV file to priority queue with LOW priority
-        priority_queue.put((Priority.LOW, "csv", filepath))
-        
-        # Start worker if not running
-        start_processing_worker()
-
-        return jsonify({
-            "message": f"CSV uploaded successfully. Added to processing queue.",
-            "queue_position": priority_queue.qsize()
-        }), 200
-
-    except Exception as e:
-        log_message(f"Error uploading CSV: {e}")
-        return jsonify({"message": f"Error uploading CSV: {e}"}), 500
-
-@bp.route("/manual_input", methods=["POST"])
-def manual_input():
-    """Handle manual UPC & ZIP input with HIGH priority"""
-    data = request.json
-    upc = data.get("upc")
-    zip_code = data.get("zip")
-
-    if not upc or not zip_code:
-        return jsonify({"message": "Both UPC and ZIP are required"}), 400
-
-    log_message(f"Adding HIGH PRIORITY manual entry to queue: UPC {upc}, ZIP {zip_code}")
-    
-    # Add manual input to priority queue with HIGH priority
-    priority_queue.put((Priority.HIGH, "manual", (str(upc), str(zip_code))))
-    
-    # Start worker if not running
-    start_processing_worker()
-    
-    return jsonify({
-        "message": "Manual entry added to priority queue and will be processed immediately",
-        "priority": "HIGH"
-    })
-
-@bp.route("/queue_status", methods=["GET"])
-def queue_status():
-    """Get current queue status"""
-    return jsonify({
-        "queue_size": priority_queue.qsize(),
-        "csv_processing": csv_processing,
-        "worker_active": processing_worker is not None and not processing_worker.dead
-    })
-
-@bp.route("/clear_queue", methods=["POST"])
-def clear_queue():
-    """Clear all pending items from queue"""
-    count = 0
-    try:
-        while True:
-            priority_queue.get_nowait()
-            count += 1
-    except queue.Empty:
-        pass
-    
-    log_message(f"Cleared {count} items from queue")
-    return jsonify({"message": f"Cleared {count} items from queue"})
+from flask import Blueprint, request, jsonify ,render_template,session,Response
+from core import processing
+from core.processing import start_processing_worker,ingest_stats
+from core.database import pool_stats
+from core.cache import search_cache
+from core.jobs import create_job, get_job, list_jobs, job_summary, job_queue
+from core.metrics import metrics_snapshot, render_prometheus
+from core.tracing import get_recent_spans, profile, profile_status
+from core.upstream import stock_client, get_dead_letters
+from utils import log_message
+from config import Config
+from werkzeug.utils import secure_filename
+import os
+import uuid
+
+
+
+UPLOAD_FOLDER = Config.UPLOAD_FOLDER
+bp = Blueprint('admin', __name__)
+
+@bp.route("/adminpanel")
+def admin():
+    """Admin panel route"""
+    return render_template("admin.html")
+
+@bp.route('/clear_logs', methods=['POST'])
+def clear_logs():
+    if 'logs' in session:
+        session.pop('logs')  # Remove only logs (keeps other session data)
+        session.modified = True  # Force save
+        return jsonify({"message": "Logs cleared successfully"})
+    return jsonify({"message": "No logs to clear"}), 404
+
+@bp.route("/upload_csv", methods=["POST"])
+def upload_csv():
+    """Handle CSV file upload and process each entry"""
+    try:
+        if "file" not in request.files:
+            return jsonify({"message": "No file provided"}), 400
+
+        file = request.files["file"]
+        if file.filename == "":
+            return jsonify({"message": "No selected file"}), 400
+
+        # The job reads the saved file until it is done, possibly after a
+        # restart, so a later upload with the same name must not replace it
+        filepath = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{secure_filename(file.filename)}")
+        file.save(filepath)
+        log_message(f"CSV uploaded. Adding to processing queue... {file.filename}")
+
+        # Record the job with LOW priority; any worker process may claim it
+        job_id = create_job(filepath, filename=file.filename)
+        job_queue.put_csv(job_id)
+        
+        # Start worker if not running
+        start_processing_worker()
+
+        return jsonify({
+            "message": f"CSV uploaded successfully. Added to processing queue.",
+            "job_id": job_id,
+            "queue_position": job_queue.qsize()
+        }), 200
+
+    except Exception as e:
+        log_message(f"Error uploading CSV: {e}", "error")
+        return jsonify({"message": f"Error uploading CSV: {e}"}), 500
+
+@bp.route("/manual_input", methods=["POST"])
+def manual_input():
+    """Handle manual UPC & ZIP input with HIGH priority"""
+    data = request.json
+    upc = data.get("upc")
+    zip_code = data.get("zip")
+
+    if not upc or not zip_code:
+        return jsonify({"message": "Both UPC and ZIP are required"}), 400
+
+    log_message(f"Adding HIGH PRIORITY manual entry to queue: UPC {upc}, ZIP {zip_code}")
+    
+    # Add manual input to the high-priority lane
+    job_queue.put_manual(str(upc), str(zip_code))
+    
+    # Start worker if not running
+    start_processing_worker()
+    
+    return jsonify({
+        "message": "Manual entry added to priority queue and will be processed immediately",
+        "priority": "HIGH"
+    })
+
+@bp.route("/queue_status", methods=["GET"])
+def queue_status():
+    """Get current queue status, the running job's progress and live metrics"""
+    # Read through the module: these globals are rebound by the worker
+    worker = processing.processing_worker
+    return jsonify({
+        "queue_size": job_queue.qsize(),
+        "queue_lanes": job_queue.lane_sizes(),
+        "csv_processing": processing.csv_processing,
+        "worker_active": worker is not None and not worker.dead,
+        "current_job": processing.current_job_progress(),
+        "lookups": ingest_stats,
+        "api_circuit": stock_client.breaker.state,
+        "metrics": metrics_snapshot()
+    })
+
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose metrics in the Prometheus text format"""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@bp.route("/jobs", methods=["GET"])
+def jobs():
+    """List recent CSV jobs with their journal and throughput"""
+    status = request.args.get("status")
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify([job_summary(job) for job in list_jobs(status, limit)])
+
+@bp.route("/jobs/<int:job_id>", methods=["GET"])
+def job_detail(job_id):
+    """Get the journal of one CSV job"""
+    job = get_job(job_id)
+    if job is None or job["kind"] != "csv":
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job_summary(job))
+
+@bp.route("/trace_spans", methods=["GET"])
+def trace_spans():
+    """List recent timing spans, newest first; name filters to one span type"""
+    name = request.args.get("name")
+    limit = request.args.get("limit", 100, type=int)
+    return jsonify(get_recent_spans(name, limit))
+
+@bp.route("/profile", methods=["POST"])
+def run_profile():
+    """Profile the running server for a few seconds and return the pstats report"""
+    data = request.json or {}
+    seconds = data.get("seconds", 10)
+    sort = data.get("sort", "cumulative")
+    if not isinstance(seconds, (int, float)) or not 0 < seconds <= Config.PROFILE_MAX_SECONDS:
+        return jsonify({"message": f"seconds must be between 0 and {Config.PROFILE_MAX_SECONDS}"}), 400
+    if sort not in ("cumulative", "tottime", "ncalls"):
+        return jsonify({"message": "sort must be cumulative, tottime or ncalls"}), 400
+    try:
+        limit = int(data.get("limit", 50))
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= Config.PROFILE_MAX_LIMIT:
+        return jsonify({"message": f"limit must be a whole number between 1 and {Config.PROFILE_MAX_LIMIT}"}), 400
+    # cProfile allows one active profiler per thread
+    if profile_status["running"]:
+        return jsonify({"message": "A profile is already running", "status": profile_status}), 409
+
+    log_message(f"Profiling for {seconds}s")
+    report = profile(seconds, sort, limit)
+    return Response(report, mimetype="text/plain")
+
+@bp.route("/dead_letters", methods=["GET"])
+def dead_letters():
+    """List lookups that failed after every retry"""
+    limit = request.args.get("limit", 100, type=int)
+    return jsonify(get_dead_letters(limit))
+
+@bp.route("/db_pool_status", methods=["GET"])
+def db_pool_status():
+    """Get connection pool metrics for each database"""
+    return jsonify(pool_stats())
+
+@bp.route("/cache_status", methods=["GET"])
+def cache_status():
+    """Get search result cache metrics"""
+    return jsonify(search_cache.metrics())
+
+@bp.route("/clear_queue", methods=["POST"])
+def clear_queue():
+    """Clear all pending items from queue"""
+    count = job_queue.clear()
+    
+    log_message(f"Cleared {count} items from queue")
+    return jsonify({"message": f"Cleared {count} items from queue"})
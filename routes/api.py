@@ -0,0 +1,80 @@
+import math
+from flask import Blueprint, request, jsonify
+from core.search import search_page, PAGE_FIELDS, PAGE_SORTS
+from config import Config
+from utils import encode_cursor, decode_cursor, is_cursor_key
+
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+TRUE_VALUES = ("1", "true", "on", "yes")
+
+
+def arg_flag(name):
+    return request.args.get(name, "").lower() in TRUE_VALUES
+
+
+@bp.route("/search", methods=["GET"])
+def search():
+    """Return one page of search results in columnar form.
+
+    Takes the filters of the search form (upc, zipcode or a comma-separated
+    zipcodes list, city, state, price, deals, in_stock), fields to pick the
+    returned columns, and sort (store, price or margin) with order asc or
+    desc. Pages are keyset-paginated on (sort value, store_id, item_id):
+    pass the previous response's next_cursor to get the following page.
+    """
+    fields = [field.strip() for field in request.args.get("fields", "").split(",") if field.strip()] or list(PAGE_FIELDS)
+    unknown = [field for field in fields if field not in PAGE_FIELDS]
+    if unknown:
+        return jsonify({"message": f"Unknown fields: {', '.join(unknown)}", "fields": list(PAGE_FIELDS)}), 400
+
+    sort = request.args.get("sort", "store")
+    order = request.args.get("order", "asc").lower()
+    if sort not in PAGE_SORTS or order not in ("asc", "desc"):
+        return jsonify({"message": "sort must be store, price or margin and order asc or desc"}), 400
+
+    zipcodes = [z.strip() for z in request.args.get("zipcodes", "").split(",") if z.strip()]
+    if len(zipcodes) > Config.API_SEARCH_MAX_ZIPCODES:
+        return jsonify({"message": f"At most {Config.API_SEARCH_MAX_ZIPCODES} zipcodes per request"}), 400
+
+    price = request.args.get("price", "")
+    if price:
+        try:
+            price = float(price)
+        except ValueError:
+            return jsonify({"message": "price must be a number"}), 400
+        if not math.isfinite(price) or price < 0:
+            return jsonify({"message": "price must be a finite number of at least 0"}), 400
+    else:
+        price = None
+
+    limit = request.args.get("limit", Config.API_SEARCH_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.API_SEARCH_PAGE_LIMIT))
+
+    after = None
+    cursor_param = request.args.get("cursor")
+    if cursor_param:
+        try:
+            after = decode_cursor(cursor_param)
+        except (ValueError, TypeError):
+            return jsonify({"message": "Invalid cursor"}), 400
+        if not is_cursor_key(after, 2 if sort == "store" else 3):
+            return jsonify({"message": "Cursor does not match the sort"}), 400
+
+    rows, next_key = search_page(
+        fields, sort, order == "desc", limit, after, zipcodes,
+        upc=request.args.get("upc", "").strip(),
+        motherzipcode=request.args.get("zipcode", "").strip(),
+        city=request.args.get("city", ""),
+        state=request.args.get("state", ""),
+        price=price,
+        deal_filter=arg_flag("deals"),
+        remove_zero_inventory=arg_flag("in_stock"),
+    )
+
+    return jsonify({
+        "columns": fields,
+        "rows": [list(row) for row in rows],
+        "next_cursor": encode_cursor(next_key) if next_key else None
+    })
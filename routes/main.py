@@ -1,291 +1,252 @@
-from flask import Blueprint, render_template, request, Response, session, jsonify,flash
-from core.search import search_by_zip_upc,bulk_search_by_zipcodes,bulk_search_by_zipcodes_chunked,process_zipcode_file
-from core.database import get_db_connection
-from utils import get_size_kb
-from config import Config
-import csv
-import io
-from utils import log_message
-bp = Blueprint('main', __name__)
-
-
-DATABASE = Config.DATABASE
-
-
-@bp.route("/", methods=["GET", "POST"])
-def index():
-    """Debug version with detailed logging"""
-    print("=== INDEX ROUTE CALLED ===")
-    print(f"Request method: {request.method}")
-    
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-
-        # Fetch distinct cities and states for dropdowns
-        cursor.execute("SELECT DISTINCT city FROM stores ORDER BY city")
-        cities = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute("SELECT DISTINCT state FROM stores ORDER BY state")
-        states = [row[0] for row in cursor.fetchall()]
-
-    results = None
-    price = ""
-    deal_filter = False
-
-    if request.method == "POST":
-        print("=== POST REQUEST DETECTED ===")
-        
-        # Debug: Print all form data
-        print("Form data:")
-        for key, value in request.form.items():
-            print(f"  {key}: {value}")
-        
-        # Debug: Print all files
-        print("Files:")
-        for key, file in request.files.items():
-            print(f"  {key}: {file.filename if file else 'No file'}")
-        
-        search_mode = request.form.get("search_mode", "single")
-        print(f"Search mode: {search_mode}")
-        
-        price = request.form.get("price", "")
-        deal_filter = request.form.get("deal_filter") == "on"
-        remove_zero_inventory = request.form.get("remove_zero_inventory") == "on"
-        
-        print(f"Price: {price}")
-        print(f"Deal filter: {deal_filter}")
-        print(f"Remove zero inventory: {remove_zero_inventory}")
-        
-        # Handle zero inventory removal (common to both search modes)
-        if remove_zero_inventory:
-            print("Processing zero inventory removal...")
-            with get_db_connection(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    DELETE FROM store_items 
-                    WHERE salesfloor = 0 AND backroom = 0
-                """)
-                deleted_count = cursor.rowcount
-                conn.commit()
-                log_message(f"Deleted {deleted_count} items with zero inventory")
-                print(f"Deleted {deleted_count} items with zero inventory")
-
-        # Handle bulk search
-        if search_mode == "bulk":
-            print("=== PROCESSING BULK SEARCH ===")
-            
-            uploaded_file = request.files.get('csv_file')
-            print(f"Uploaded file: {uploaded_file}")
-            print(f"File name: {uploaded_file.filename if uploaded_file else 'None'}")
-            
-            if not uploaded_file or uploaded_file.filename == '':
-                print("ERROR: No file uploaded")
-                flash('Please upload a CSV or XLSX file for bulk search.', 'error')
-                return render_template("index.html", results=None, cities=cities, states=states, price=price)
-            
-            print(f"Processing file: {uploaded_file.filename}")
-            
-            # Process file and extract zipcodes
-            try:
-                zipcodes, error = process_zipcode_file(uploaded_file)
-                print(f"Zipcodes extracted: {len(zipcodes) if zipcodes else 0}")
-                print(f"Error: {error}")
-                
-                if error:
-                    print(f"ERROR in file processing: {error}")
-                    flash(error, 'error')
-                    return render_template("index.html", results=None, cities=cities, states=states, price=price)
-                
-                if not zipcodes:
-                    print("ERROR: No zipcodes found")
-                    flash('No valid zipcodes found in uploaded file.', 'warning')
-                    return render_template("index.html", results=None, cities=cities, states=states, price=price)
-                
-                print(f"First 5 zipcodes: {zipcodes[:5]}")
-                
-                # Get bulk search parameters
-                upc = request.form.get('bulk_upc', '').strip()
-                print(f"Bulk UPC: '{upc}'")
-                
-                # Perform bulk search
-                print("Starting bulk search...")
-                
-                if len(zipcodes) > 100:
-                    print("Using chunked search for large zipcode list")
-                    results = bulk_search_by_zipcodes_chunked(
-                        zipcodes=zipcodes,
-                        upc=upc,
-                        price=price,
-                        deal_filter=deal_filter,
-                        remove_zero_inventory=False  # Already handled above
-                    )
-                else:
-                    print("Using regular search for small zipcode list")
-                    results = bulk_search_by_zipcodes(
-                        zipcodes=zipcodes,
-                        upc=upc,
-                        price=price,
-                        deal_filter=deal_filter,
-                        remove_zero_inventory=False  # Already handled above
-                    )
-                
-                print(f"Search completed. Results count: {len(results) if results else 0}")
-                
-                if results:
-                    results_size_kb = get_size_kb(results)
-                    print(f"Bulk search found: {results_size_kb} KB worth of data from {len(zipcodes)} zipcodes")
-                    
-                    # Prepare CSV export for bulk results
-                    print("Preparing CSV export...")
-                    output = io.StringIO()
-                    writer = csv.writer(output)
-
-                    # Write header
-                    writer.writerow([
-                        "UPC", "Name", "Store Address", "Store Price",  
-                        "Salesfloor", "Backroom", "City", 
-                        "State", "Aisles", "Zipcode", "Max Price Noted", "Description", "Net", "Department", "Product ID"
-                    ])
-
-                    for row in results:
-                        upc_code = row[6]
-                        max_price = row[14] or ""      # max_price from JOIN
-                        description = row[15] or ""    # description from JOIN
-                        net = row[16] or ""           # net from JOIN
-                        department = row[17] or ""    # department from JOIN
-                        productid = row[18] or ""     # productid from JOIN      
-                        zipcode = row[3]              # zipcode from results
-                        
-                        writer.writerow([
-                            upc_code, row[5], row[0], row[10],  
-                            row[11], row[12], row[1], 
-                            row[2], row[13], zipcode, max_price, description, net, department, productid
-                        ])
-
-                    output.seek(0)
-
-                    # Generate filename for bulk export
-                    filename = "bulk_search_results"
-                    filters = []
-                    
-                    if upc:
-                        filters.append(f"UPC_{upc}")
-                    if price:
-                        filters.append(f"Price_{price}")
-                    if deal_filter:
-                        filters.append("DealsOnly")
-                    
-                    filters.append(f"Zipcodes_{len(zipcodes)}")
-
-                    if filters:
-                        filename += "_" + "_".join(filters)
-
-                    filename += ".csv"
-                    
-                    print(f"Returning CSV file: {filename}")
-
-                    return Response(
-                        output.getvalue(), 
-                        mimetype="text/csv", 
-                        headers={"Content-Disposition": f"attachment;filename={filename}"}
-                    )
-                else:
-                    print("No results found, returning empty results")
-                    flash(f'Bulk search completed for {len(zipcodes)} zipcodes. No results found.', 'info')
-                    return render_template("index.html", results=[], cities=cities, states=states, price=price)
-                
-            except Exception as e:
-                print(f"EXCEPTION in bulk search: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                flash(f'Error performing bulk search: {str(e)}', 'error')
-                return render_template("index.html", results=None, cities=cities, states=states, price=price)
-
-        # Handle single search (original logic)
-        else:
-            print("=== PROCESSING SINGLE SEARCH ===")
-            upc = request.form.get("upc")
-            zipcode = request.form.get("zipcode")
-            city = request.form.get("city", "")
-            state = request.form.get("state", "")
-
-            print(f"Single search params - UPC: {upc}, Zipcode: {zipcode}, City: {city}, State: {state}")
-
-            # Get results with all data in single query
-            results = search_by_zip_upc(upc, zipcode, city, state, price, deal_filter)
-            results_size_kb = get_size_kb(results)
-            print(f"Single search found: {results_size_kb} KB worth of data")
-            
-            # Prepare CSV export for single search
-            output = io.StringIO()
-            writer = csv.writer(output)
-
-            # Write header
-            writer.writerow([
-                "UPC", "Name", "Store Address", "Store Price",  
-                "Salesfloor", "Backroom", "City", 
-                "State", "Aisles", "Max Price Noted", "Description", "Net", "Department", "Product ID"
-            ])
-
-            for row in results:
-                upc_code = row[6]
-                max_price = row[14] or ""      # max_price from JOIN
-                description = row[15] or ""    # description from JOIN
-                net = row[16] or ""           # net from JOIN
-                department = row[17] or ""    # department from JOIN
-                productid = row[18] or ""     # productid from JOIN      
-                writer.writerow([
-                    upc_code, row[5], row[0], row[10],  
-                    row[11], row[12], row[1], 
-                    row[2], row[13], max_price, description, net, department, productid
-                ])
-
-            output.seek(0)
-
-            # Generate filename for single search
-            filename = "search_results"
-
-            filters = []
-            if upc:
-                filters.append(f"UPC_{upc}")
-            if zipcode:
-                filters.append(f"ZIP_{zipcode}")
-            if city:
-                filters.append(f"City_{city}")
-            if state:
-                filters.append(f"State_{state}")
-            if price:
-                filters.append(f"Price_{price}")
-            if deal_filter:
-                filters.append("DealsOnly")
-
-            if filters:
-                filename += "_" + "_".join(filters)
-
-            filename += ".csv"
-
-            print(f"Returning single search CSV: {filename}")
-
-            return Response(
-                output.getvalue(), 
-                mimetype="text/csv", 
-                headers={"Content-Disposition": f"attachment;filename={filename}"}
-            )
-    
-    print("=== RETURNING GET REQUEST ===")
-    return render_template("index.html", results=results, cities=cities, states=states, price=price)
-
-@bp.route("/get_cities")
-def get_cities():
-    """API endpoint to get cities by state for dynamic form updates"""
-    state = request.args.get("state")
-
-    if not state:
-        return jsonify([]) 
-
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT city FROM stores WHERE state = ? ORDER BY city", (state,))
-        cities = [row[0] for row in cursor.fetchall()]
-
-    return jsonify(cities)
+from flask import Blueprint, render_template, request, Response, session, jsonify,flash
+from core.search import iter_search_by_zip_upc,iter_bulk_search_by_zipcodes,process_zipcode_file
+from core.cache import location_index
+from core.price_history import get_price_series, get_price_range, get_price_drops
+from core.tracing import span
+from config import Config
+import csv
+import io
+import itertools
+import time
+from utils import log_message
+bp = Blueprint('main', __name__)
+
+
+DATABASE = Config.DATABASE
+
+SINGLE_CSV_HEADER = [
+    "UPC", "Name", "Store Address", "Store Price",  
+    "Salesfloor", "Backroom", "City", 
+    "State", "Aisles", "Max Price Noted", "Description", "Net", "Department", "Product ID"
+]
+
+BULK_CSV_HEADER = [
+    "UPC", "Name", "Store Address", "Store Price",  
+    "Salesfloor", "Backroom", "City", 
+    "State", "Aisles", "Zipcode", "Max Price Noted", "Description", "Net", "Department", "Product ID"
+]
+
+
+def single_csv_row(row):
+    """Map a search result row to the single search CSV columns"""
+    upc_code = row[6]
+    max_price = row[14] or ""      # max_price from JOIN
+    description = row[15] or ""    # description from JOIN
+    net = row[16] or ""           # net from JOIN
+    department = row[17] or ""    # department from JOIN
+    productid = row[18] or ""     # productid from JOIN      
+    return [
+        upc_code, row[5], row[0], row[10],  
+        row[11], row[12], row[1], 
+        row[2], row[13], max_price, description, net, department, productid
+    ]
+
+
+def bulk_csv_row(row):
+    """Map a search result row to the bulk search CSV columns"""
+    upc_code = row[6]
+    max_price = row[14] or ""      # max_price from JOIN
+    description = row[15] or ""    # description from JOIN
+    net = row[16] or ""           # net from JOIN
+    department = row[17] or ""    # department from JOIN
+    productid = row[18] or ""     # productid from JOIN      
+    zipcode = row[3]              # zipcode from results
+    return [
+        upc_code, row[5], row[0], row[10],  
+        row[11], row[12], row[1], 
+        row[2], row[13], zipcode, max_price, description, net, department, productid
+    ]
+
+
+def stream_csv(header, rows, format_row, name="export.csv"):
+    """Yield CSV text a chunk at a time so the export never sits in memory"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    # Covers the search feeding the export and the client reading it
+    with span(name) as attrs:
+        writer.writerow(header)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+
+        count = 0
+        for count, row in enumerate(rows, 1):
+            writer.writerow(format_row(row))
+            if count % Config.EXPORT_FETCH_SIZE == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+
+        attrs["rows"] = count
+        yield output.getvalue()
+
+
+@bp.route("/", methods=["GET", "POST"])
+def index():
+    """Search page; POST runs a single or bulk search and streams the results as CSV"""
+    # Dropdown values come from the in-memory location index
+    cities = location_index.get_cities()
+    states = location_index.get_states()
+
+    results = None
+    price = ""
+    deal_filter = False
+
+    if request.method == "POST":
+        search_mode = request.form.get("search_mode", "single")
+        
+        price = request.form.get("price", "")
+        deal_filter = request.form.get("deal_filter") == "on"
+        remove_zero_inventory = request.form.get("remove_zero_inventory") == "on"
+        
+        # Handle bulk search
+        if search_mode == "bulk":
+            uploaded_file = request.files.get('csv_file')
+            
+            if not uploaded_file or uploaded_file.filename == '':
+                flash('Please upload a CSV or XLSX file for bulk search.', 'error')
+                return render_template("index.html", results=None, cities=cities, states=states, price=price)
+            
+            # Process file and extract zipcodes
+            try:
+                zipcodes, error = process_zipcode_file(uploaded_file)
+                
+                if error:
+                    flash(error, 'error')
+                    return render_template("index.html", results=None, cities=cities, states=states, price=price)
+                
+                if not zipcodes:
+                    flash('No valid zipcodes found in uploaded file.', 'warning')
+                    return render_template("index.html", results=None, cities=cities, states=states, price=price)
+                
+                # Get bulk search parameters
+                upc = request.form.get('bulk_upc', '').strip()
+                
+                # One query for the whole upload, no matter how many zipcodes
+                results = iter_bulk_search_by_zipcodes(
+                    zipcodes=zipcodes,
+                    upc=upc,
+                    price=price or None,
+                    deal_filter=deal_filter,
+                    remove_zero_inventory=remove_zero_inventory
+                )
+                
+                # Read one row up front so an empty result can still be reported on the page
+                first_row = next(results, None)
+                
+                if first_row is not None:
+                    results = itertools.chain([first_row], results)
+
+                    # Generate filename for bulk export
+                    filename = "bulk_search_results"
+                    filters = []
+                    
+                    if upc:
+                        filters.append(f"UPC_{upc}")
+                    if price:
+                        filters.append(f"Price_{price}")
+                    if deal_filter:
+                        filters.append("DealsOnly")
+                    
+                    filters.append(f"Zipcodes_{len(zipcodes)}")
+
+                    if filters:
+                        filename += "_" + "_".join(filters)
+
+                    filename += ".csv"
+
+                    return Response(
+                        stream_csv(BULK_CSV_HEADER, results, bulk_csv_row, "export.bulk_csv"), 
+                        mimetype="text/csv", 
+                        headers={"Content-Disposition": f"attachment;filename={filename}"}
+                    )
+                else:
+                    results.close()
+                    flash(f'Bulk search completed for {len(zipcodes)} zipcodes. No results found.', 'info')
+                    return render_template("index.html", results=[], cities=cities, states=states, price=price)
+                
+            except Exception as e:
+                log_message(f"Error performing bulk search: {e}", "error")
+                flash(f'Error performing bulk search: {str(e)}', 'error')
+                return render_template("index.html", results=None, cities=cities, states=states, price=price)
+
+        # Handle single search (original logic)
+        else:
+            upc = request.form.get("upc")
+            zipcode = request.form.get("zipcode")
+            city = request.form.get("city", "")
+            state = request.form.get("state", "")
+
+            # Rows are read from the cursor while the CSV is being sent
+            results = iter_search_by_zip_upc(upc, zipcode, city, state, price or None, deal_filter, remove_zero_inventory)
+
+            # Generate filename for single search
+            filename = "search_results"
+
+            filters = []
+            if upc:
+                filters.append(f"UPC_{upc}")
+            if zipcode:
+                filters.append(f"ZIP_{zipcode}")
+            if city:
+                filters.append(f"City_{city}")
+            if state:
+                filters.append(f"State_{state}")
+            if price:
+                filters.append(f"Price_{price}")
+            if deal_filter:
+                filters.append("DealsOnly")
+
+            if filters:
+                filename += "_" + "_".join(filters)
+
+            filename += ".csv"
+
+            return Response(
+                stream_csv(SINGLE_CSV_HEADER, results, single_csv_row), 
+                mimetype="text/csv", 
+                headers={"Content-Disposition": f"attachment;filename={filename}"}
+            )
+    
+    return render_template("index.html", results=results, cities=cities, states=states, price=price)
+
+@bp.route("/get_cities")
+def get_cities():
+    """API endpoint to get cities by state for dynamic form updates"""
+    state = request.args.get("state")
+
+    if not state:
+        return jsonify([]) 
+
+    response = jsonify(location_index.get_cities(state))
+    response.set_etag(f"{location_index.get_etag()}-{state}")
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.CITIES_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+@bp.route("/price_history")
+def price_history():
+    """API endpoint returning a UPC's price series and min/max per store"""
+    upc = request.args.get("upc", "").strip()
+    if not upc:
+        return jsonify({"message": "UPC is required"}), 400
+
+    store_id = request.args.get("store_id", type=int)
+    days = request.args.get("days", 30, type=int)
+    since = int(time.time()) - days * 24 * 60 * 60
+
+    return jsonify({
+        "upc": upc,
+        "since": since,
+        "series": get_price_series(upc, store_id, since),
+        "range": get_price_range(upc, store_id, since),
+    })
+
+@bp.route("/price_drops")
+def price_drops():
+    """API endpoint listing the biggest price drops over the last N days"""
+    days = request.args.get("days", 7, type=int)
+    limit = request.args.get("limit", 100, type=int)
+    since = int(time.time()) - days * 24 * 60 * 60
+    return jsonify(get_price_drops(since, limit))
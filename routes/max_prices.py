@@ -1,311 +1,265 @@
-from flask import Blueprint, request, jsonify,render_template
-from core.database import get_db_connection
-from config import Config
-import csv
-import os
-from utils import log_message
-import sqlite3
-import time
-
-
-bp = Blueprint('max_prices', __name__)
-
-DATABASE = Config.DATABASE
-UPLOAD_FOLDER = Config.UPLOAD_FOLDER
-UPCZIP_DB = Config.UPCZIP_DB
-@bp.route("/max_prices")
-def max_prices():
-    """Route for managing UPC max prices"""
-    return render_template("max_prices.html")
-
-@bp.route("/upload_max_prices", methods=["POST"])
-def upload_max_prices():
-    """Handle CSV file upload for UPC max prices"""
-    try:
-        if "file" not in request.files:
-            return jsonify({"message": "No file provided"}), 400
-
-        file = request.files["file"]
-        if file.filename == "":
-            return jsonify({"message": "No selected file"}), 400
-
-        # Save and process the file
-        filepath = os.path.join(UPLOAD_FOLDER, "max_prices_" + file.filename)
-        file.save(filepath)
-        log_message(f"Max prices CSV uploaded. Processing... {filepath}")
-
-        # Process CSV file
-        success_count = 0
-        error_count = 0
-
-        with get_db_connection(DATABASE) as conn:
-            cursor = conn.cursor()
-            
-            with open(filepath, "r", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                headers = [h.upper() for h in next(reader)]  # Convert headers to uppercase
-                
-                # Find column indices (case-insensitive matching)
-                upc_col = next((i for i, h in enumerate(headers) if h == "UPC"), None)
-                price_col = next((i for i, h in enumerate(headers) if h == "PRICE"), None)
-                desc_col = next((i for i, h in enumerate(headers) if h == "DESCRIPTION"), None)
-                net_col = next((i for i, h in enumerate(headers) if h == "NET"), None)
-                dept_col = next((i for i, h in enumerate(headers) if h == "DEPARTMENT"), None)
-                product_col = next((i for i, h in enumerate(headers) if h == "PRODUCTID"), None)
-                
-                if upc_col is None or price_col is None:
-                    os.remove(filepath)
-                    return jsonify({"message": "CSV must contain UPC and PRICE columns"}), 400
-                
-                for row in reader:
-                    if len(row) <= max(upc_col, price_col):
-                        error_count += 1
-                        continue
-                        
-                    upc = row[upc_col].strip()
-                    price_str = row[price_col].strip()
-                    
-                    # Remove currency symbols and clean price string
-                    price_str = price_str.replace('$', '').replace('£', '').replace('€', '').strip()
-                    
-                    # Get optional fields if available
-                    description = ""
-                    if desc_col is not None and len(row) > desc_col:
-                        description = row[desc_col].strip()
-                    
-                    net = None
-                    if net_col is not None and len(row) > net_col and row[net_col].strip():
-                        net_str = row[net_col].strip().replace('$', '').replace('£', '').replace('€', '').strip()
-                        try:
-                            net = float(net_str)
-                        except ValueError:
-                            pass  # Leave as None if can't convert
-                    
-                    department = ""
-                    if dept_col is not None and len(row) > dept_col:
-                        department = row[dept_col].strip()
-                    
-                    productid = ""
-                    if product_col is not None and len(row) > product_col:
-                        productid = row[product_col].strip()
-                    
-                    if not upc or not price_str:
-                        error_count += 1
-                        continue
-                    
-                    try:
-                        price = float(price_str)
-                        cursor.execute("""
-                            INSERT INTO upc_max_prices (upc, max_price, description, net, department , productid)
-                            VALUES (?, ?, ?, ?, ? , ?)
-                            ON CONFLICT(upc) DO UPDATE 
-                            SET max_price = excluded.max_price, 
-                                description = excluded.description,
-                                net = excluded.net,
-                                department = excluded.department,
-                                productid = excluded.productid
-                        """, (upc, price, description, net, department, productid))
-                        success_count += 1
-                    except (ValueError, sqlite3.Error) as e:
-                        log_message(f"Error processing {upc}: {str(e)}")
-                        error_count += 1
-            
-            conn.commit()
-        
-        os.remove(filepath)
-        
-        return jsonify({
-            "message": f"Max prices uploaded successfully. Processed: {success_count}, Errors: {error_count}"
-        }), 200
-        
-    except Exception as e:
-        return jsonify({"message": f"Error uploading max prices: {str(e)}"}), 500
-
-# Update the manage_max_price route to handle new fields
-@bp.route("/manage_max_price", methods=["POST"])
-def manage_max_price():
-    """Add, update or delete a max price record"""
-    try:
-        data = request.json
-        action = data.get("action")
-        
-        with get_db_connection(DATABASE) as conn:
-            cursor = conn.cursor()
-            
-            if action == "add":
-                upc = data.get("upc")
-                price = data.get("price")
-                description = data.get("description", "")
-                net = data.get("net")
-                department = data.get("department", "")
-                productid = data.get("productid","")
-                
-                if not upc or not price:
-                    return jsonify({"success": False, "message": "UPC and price are required"}), 400
-                
-                try:
-                    price = float(price)
-                    if net is not None and net != "":
-                        net = float(net)
-                    else:
-                        net = None
-                        
-                    cursor.execute("""
-                        INSERT INTO upc_max_prices (upc, max_price, description, net, department,productid)
-                        VALUES (?, ?, ?, ?, ? , ?)
-                        ON CONFLICT(upc) DO UPDATE 
-                        SET max_price = excluded.max_price, 
-                            description = excluded.description,
-                            net = excluded.net,
-                            department = excluded.department,
-                            productid = excluded.productid
-                            
-                    """, (upc, price, description, net, department,productid))
-                    conn.commit()
-                    
-                    return jsonify({
-                        "success": True, 
-                        "message": f"Max price for UPC {upc} added/updated successfully"
-                    }), 200
-                except ValueError:
-                    return jsonify({
-                        "success": False, 
-                        "message": "Price and net must be valid numbers"
-                    }), 400
-                except sqlite3.Error as e:
-                    return jsonify({
-                        "success": False, 
-                        "message": f"Database error: {str(e)}"
-                    }), 500
-            
-            elif action == "delete":
-                upc = data.get("upc")
-                
-                if not upc:
-                    return jsonify({"success": False, "message": "UPC is required"}), 400
-                
-                try:
-                    cursor.execute("DELETE FROM upc_max_prices WHERE upc = ?", (upc,))
-                    conn.commit()
-                    
-                    return jsonify({
-                        "success": True, 
-                        "message": f"Max price for UPC {upc} deleted successfully"
-                    }), 200
-                except sqlite3.Error as e:
-                    return jsonify({
-                        "success": False, 
-                        "message": f"Database error: {str(e)}"
-                    }), 500
-            
-            else:
-                return jsonify({
-                    "success": False, 
-                    "message": "Invalid action"
-                }), 400
-                
-    except Exception as e:
-        return jsonify({
-            "success": False, 
-            "message": f"Error managing max price: {str(e)}"
-        }), 500
-
-@bp.route("/get_max_prices", methods=["GET"])
-def get_max_prices():
-    """Return all UPC max price entries"""
-    with get_db_connection(DATABASE) as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT ump.upc, ump.max_price, ump.description, ump.net, ump.department ,ump.productid , i.name 
-            FROM upc_max_prices ump
-            LEFT JOIN items i ON ump.upc = i.upc
-            ORDER BY ump.upc
-        """)
-        
-        results = cursor.fetchall()
-    
-    max_prices = []
-    for row in results:
-        max_prices.append({
-            "upc": row[0],
-            "max_price": row[1],
-            "description": row[2],
-            "net": row[3],
-            "department": row[4],
-            "productid" : row[5],
-            "name": row[6] if row[6] else "Unknown Item"
-        })
-    
-    return jsonify(max_prices)
-@bp.route('/clear_old_items', methods=['POST'])
-def clear_old_items():
-    """Delete items from database older than specified days"""
-    try:
-        data = request.json
-        days = data.get('days', 30)  # Default to 30 days if not specified
-        
-        if not isinstance(days, int) or days < 1:
-            return jsonify({"message": "Invalid days parameter. Must be a positive integer.", "success": False}), 400
-            
-        # Calculate the cutoff timestamp (current time - days)
-        cutoff_timestamp = int(time.time()) - (days * 24 * 60 * 60)
-        
-        # Step 1: Get the list of UPCs to be deleted from upczip table
-        with get_db_connection(UPCZIP_DB) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT upc FROM upczip WHERE timestamp < ?", (cutoff_timestamp,))
-            old_upcs = [row[0] for row in cursor.fetchall()]
-            
-            # Now delete the old records from upczip
-            cursor.execute("DELETE FROM upczip WHERE timestamp < ?", (cutoff_timestamp,))
-            upczip_deleted = cursor.rowcount
-            conn.commit()
-        
-        log_message(f"Found {len(old_upcs)} unique UPCs to remove")
-        
-        # Step 2: Delete from other tables in the main database
-        items_deleted = 0
-        store_items_deleted = 0
-        price_history_deleted = 0
-        
-        if old_upcs:
-            with get_db_connection(DATABASE) as conn:
-                cursor = conn.cursor()
-                
-                # First, find all item IDs associated with these UPCs
-                placeholders = ','.join(['?' for _ in old_upcs])
-                cursor.execute(f"SELECT id FROM items WHERE upc IN ({placeholders})", old_upcs)
-                item_ids = [row[0] for row in cursor.fetchall()]
-                
-                # Step 3: Delete from store_items using the item IDs
-                if item_ids:
-                    placeholders = ','.join(['?' for _ in item_ids])
-                    cursor.execute(f"DELETE FROM store_items WHERE item_id IN ({placeholders})", item_ids)
-                    store_items_deleted = cursor.rowcount
-                    
-                    # Step 4: Delete price history records using the item IDs
-                    cursor.execute(f"DELETE FROM price_history WHERE item_id IN ({placeholders})", item_ids)
-                    price_history_deleted = cursor.rowcount
-                
-                # Step 5: Finally delete the items from the items table
-                placeholders = ','.join(['?' for _ in old_upcs])
-                cursor.execute(f"DELETE FROM items WHERE upc IN ({placeholders})", old_upcs)
-                items_deleted = cursor.rowcount
-                
-                conn.commit()
-        
-        log_message(f"Cleared items older than {days} days: {upczip_deleted} UPC-ZIP combinations, {items_deleted} items, {store_items_deleted} store items, {price_history_deleted} price history records")
-        
-        return jsonify({
-            "message": f"Successfully removed {upczip_deleted} UPC-ZIP combinations, {items_deleted} items, {store_items_deleted} store items, and {price_history_deleted} price history records older than {days} days.",
-            "success": True,
-            "upczip_deleted": upczip_deleted,
-            "items_deleted": items_deleted,
-            "store_items_deleted": store_items_deleted,
-            "price_history_deleted": price_history_deleted
-        })
-        
-    except Exception as e:
-        log_message(f"Error clearing old items: {str(e)}")
-        return jsonify({"message": f"Error: {str(e)}", "success": False}), 500
\ No newline at end of file
+from flask import Blueprint, request, jsonify,render_template
+from core.database import get_db_connection
+from core.cache import bump_data_version
+from core.max_prices import load_max_prices
+from core.maintenance import schedule_retention
+from core.retention import retention_status
+from config import Config
+from utils import log_message, encode_cursor, decode_cursor, is_cursor_key
+import sqlite3
+import time
+
+
+bp = Blueprint('max_prices', __name__)
+
+DATABASE = Config.DATABASE
+UPLOAD_FOLDER = Config.UPLOAD_FOLDER
+UPCZIP_DB = Config.UPCZIP_DB
+@bp.route("/max_prices")
+def max_prices():
+    """Route for managing UPC max prices"""
+    return render_template("max_prices.html")
+
+@bp.route("/upload_max_prices", methods=["POST"])
+def upload_max_prices():
+    """Handle CSV file upload for UPC max prices"""
+    try:
+        if "file" not in request.files:
+            return jsonify({"message": "No file provided"}), 400
+
+        file = request.files["file"]
+        if file.filename == "":
+            return jsonify({"message": "No selected file"}), 400
+
+        # Parse and validate the whole sheet in memory before touching the
+        # database, so the write lock is only held for the final upsert.
+        log_message(f"Max prices CSV uploaded. Processing... {file.filename}")
+        started = time.time()
+        records, report = load_max_prices(file.stream)
+        if records is None:
+            return jsonify({"message": report}), 400
+
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO upc_max_prices (upc, max_price, description, net, department, productid)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(upc) DO UPDATE 
+                SET max_price = excluded.max_price, 
+                    description = excluded.description,
+                    net = excluded.net,
+                    department = excluded.department,
+                    productid = excluded.productid
+            """, records)
+            bump_data_version(cursor)
+            conn.commit()
+
+        error_count = report["missing_upc"] + report["invalid_price"]
+        log_message(f"Imported {report['imported']} max prices from {report['rows']} rows in {time.time() - started:.2f}s ({error_count} rejected, {report['duplicate_upc']} duplicate UPCs)")
+
+        return jsonify({
+            "message": f"Max prices uploaded successfully. Processed: {report['imported']}, Errors: {error_count}",
+            "report": report
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"message": f"Error uploading max prices: {str(e)}"}), 500
+
+# Update the manage_max_price route to handle new fields
+@bp.route("/manage_max_price", methods=["POST"])
+def manage_max_price():
+    """Add, update or delete a max price record"""
+    try:
+        data = request.json
+        action = data.get("action")
+        
+        with get_db_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            
+            if action == "add":
+                upc = data.get("upc")
+                price = data.get("price")
+                description = data.get("description", "")
+                net = data.get("net")
+                department = data.get("department", "")
+                productid = data.get("productid","")
+                
+                if not upc or not price:
+                    return jsonify({"success": False, "message": "UPC and price are required"}), 400
+                
+                try:
+                    price = float(price)
+                    if net is not None and net != "":
+                        net = float(net)
+                    else:
+                        net = None
+                        
+                    cursor.execute("""
+                        INSERT INTO upc_max_prices (upc, max_price, description, net, department,productid)
+                        VALUES (?, ?, ?, ?, ? , ?)
+                        ON CONFLICT(upc) DO UPDATE 
+                        SET max_price = excluded.max_price, 
+                            description = excluded.description,
+                            net = excluded.net,
+                            department = excluded.department,
+                            productid = excluded.productid
+                            
+                    """, (upc, price, description, net, department,productid))
+                    bump_data_version(cursor)
+                    conn.commit()
+                    
+                    return jsonify({
+                        "success": True, 
+                        "message": f"Max price for UPC {upc} added/updated successfully"
+                    }), 200
+                except ValueError:
+                    return jsonify({
+                        "success": False, 
+                        "message": "Price and net must be valid numbers"
+                    }), 400
+                except sqlite3.Error as e:
+                    return jsonify({
+                        "success": False, 
+                        "message": f"Database error: {str(e)}"
+                    }), 500
+            
+            elif action == "delete":
+                upc = data.get("upc")
+                
+                if not upc:
+                    return jsonify({"success": False, "message": "UPC is required"}), 400
+                
+                try:
+                    cursor.execute("DELETE FROM upc_max_prices WHERE upc = ?", (upc,))
+                    bump_data_version(cursor)
+                    conn.commit()
+                    
+                    return jsonify({
+                        "success": True, 
+                        "message": f"Max price for UPC {upc} deleted successfully"
+                    }), 200
+                except sqlite3.Error as e:
+                    return jsonify({
+                        "success": False, 
+                        "message": f"Database error: {str(e)}"
+                    }), 500
+            
+            else:
+                return jsonify({
+                    "success": False, 
+                    "message": "Invalid action"
+                }), 400
+                
+    except Exception as e:
+        return jsonify({
+            "success": False, 
+            "message": f"Error managing max price: {str(e)}"
+        }), 500
+
+# Sortable columns of /get_max_prices; text columns are COALESCEd to match
+# the expression indexes created in core.database.create_indexes
+MAX_PRICE_SORT_KEYS = {
+    "upc": "ump.upc",
+    "description": "COALESCE(ump.description, '')",
+    "department": "COALESCE(ump.department, '')",
+}
+
+MAX_PRICE_COLUMNS = ["upc", "max_price", "description", "net", "department", "productid", "name"]
+
+@bp.route("/get_max_prices", methods=["GET"])
+def get_max_prices():
+    """Return one page of UPC max price entries in columnar form.
+
+    Pages are keyset-paginated on (sort column, upc): pass the previous
+    response's next_cursor to get the following page. q filters on UPC
+    prefix, description or department.
+    """
+    sort = request.args.get("sort", "upc")
+    order = request.args.get("order", "asc").lower()
+    if sort not in MAX_PRICE_SORT_KEYS or order not in ("asc", "desc"):
+        return jsonify({"message": "sort must be upc, description or department and order asc or desc"}), 400
+
+    limit = request.args.get("limit", Config.MAX_PRICES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.MAX_PRICES_PAGE_LIMIT))
+    search = request.args.get("q", "").strip()
+
+    sort_expr = MAX_PRICE_SORT_KEYS[sort]
+    direction = "ASC" if order == "asc" else "DESC"
+    comparison = ">" if order == "asc" else "<"
+
+    filters = []
+    params = []
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        # UPCs match on prefix; descriptions and departments anywhere
+        filters.append("(ump.upc LIKE ? ESCAPE '\\' OR ump.description LIKE ? ESCAPE '\\' OR ump.department LIKE ? ESCAPE '\\')")
+        params.extend([escaped + "%", "%" + escaped + "%", "%" + escaped + "%"])
+
+    cursor_param = request.args.get("cursor")
+    if cursor_param:
+        try:
+            key = decode_cursor(cursor_param)
+        except (ValueError, TypeError):
+            return jsonify({"message": "Invalid cursor"}), 400
+        if not is_cursor_key(key, 2):
+            return jsonify({"message": "Invalid cursor"}), 400
+        last_value, last_upc = key
+        if sort == "upc":
+            filters.append(f"ump.upc {comparison} ?")
+            params.append(last_upc)
+        else:
+            # The single-column bound lets SQLite seek the expression index;
+            # the row-value comparison breaks ties on upc
+            filters.append(f"{sort_expr} {comparison}= ? AND ({sort_expr}, ump.upc) {comparison} (?, ?)")
+            params.extend([last_value, last_value, last_upc])
+
+    query = f"""
+        SELECT ump.upc, ump.max_price, ump.description, ump.net, ump.department, ump.productid,
+               COALESCE(i.name, 'Unknown Item'), {sort_expr}
+        FROM upc_max_prices ump
+        LEFT JOIN items i ON ump.upc = i.upc
+    """
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    # Fetch one extra row to know whether another page follows
+    query += f" ORDER BY {sort_expr} {direction}, ump.upc {direction} LIMIT ?"
+    params.append(limit + 1)
+
+    with get_db_connection(DATABASE) as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor([results[-1][7], results[-1][0]])
+
+    return jsonify({
+        "columns": MAX_PRICE_COLUMNS,
+        "rows": [list(row[:7]) for row in results],
+        "next_cursor": next_cursor
+    })
+
+@bp.route('/clear_old_items', methods=['POST'])
+def clear_old_items():
+    """Start a background job deleting items older than specified days"""
+    data = request.json
+    days = data.get('days', 30)  # Default to 30 days if not specified
+    
+    if not isinstance(days, int) or days < 1:
+        return jsonify({"message": "Invalid days parameter. Must be a positive integer.", "success": False}), 400
+    
+    # Runs on the maintenance scheduler in batches; see core.retention
+    if not schedule_retention(days):
+        return jsonify({"message": "A cleanup is already running.", "success": False, "status": retention_status}), 409
+    
+    return jsonify({
+        "message": f"Started removing items older than {days} days. Progress is shown in the logs.",
+        "success": True
+    }), 202
+
+@bp.route('/retention_status')
+def get_retention_status():
+    """Return progress of the current or last cleanup job"""
+    return jsonify(retention_status)
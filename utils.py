@@ -1,19 +1,89 @@
-import sys
-import json
-import time
-from flask_socketio import SocketIO
-
-socketio = None
-
-def init_utils(sio):
-    global socketio
-    socketio = sio
-
-def log_message(message):
-    """Log messages to console and emit to socket"""
-    print(f"Logging: {message}", flush=True)
-    socketio.emit('log_update', message, namespace="/")
-    socketio.sleep(0)
-
-def get_size_kb(data):
-    return round(sys.getsizeof(json.dumps(data)) / 1024, 2)
\ No newline at end of file
+import sys
+import json
+import time
+import base64
+from collections import deque
+from flask_socketio import SocketIO
+from config import Config
+
+socketio = None
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+# Messages waiting for the next batched emit; the oldest are dropped when full
+log_buffer = deque(maxlen=Config.LOG_BUFFER_SIZE)
+dropped_logs = 0
+
+# Latest progress snapshot per CSV job, emitted with each batch
+progress_state = {}
+
+log_flusher = None
+
+def init_utils(sio):
+    global socketio, log_flusher
+    socketio = sio
+    if log_flusher is None:
+        log_flusher = socketio.start_background_task(flush_logs_forever)
+
+def log_message(message, level="info"):
+    """Queue a log message for the console and the admin page"""
+    global dropped_logs
+    if LOG_LEVELS[level] < LOG_LEVELS[Config.LOG_LEVEL]:
+        return
+    if len(log_buffer) == log_buffer.maxlen:
+        dropped_logs += 1
+    log_buffer.append({"message": message, "level": level, "time": time.time()})
+
+def emit_progress(job_id, done, total, started_at, started_row=0):
+    """Record CSV job progress; sent to the admin page with the next log batch"""
+    elapsed = time.time() - started_at
+    rate = (done - started_row) / elapsed if elapsed > 0 else 0.0
+    remaining = max(total - done, 0) if total else 0
+    progress_state[job_id] = {
+        "job_id": job_id,
+        "done": done,
+        "total": total,
+        "rate": round(rate, 2),
+        "eta": round(remaining / rate) if rate > 0 else None,
+    }
+
+def flush_logs():
+    """Print and emit everything queued since the last flush in one batch"""
+    global dropped_logs
+    if log_buffer:
+        batch = list(log_buffer)
+        log_buffer.clear()
+        if dropped_logs:
+            batch.insert(0, {"message": f"{dropped_logs} log messages dropped", "level": "warning", "time": time.time()})
+            dropped_logs = 0
+        print("\n".join(f"Logging: {entry['message']}" for entry in batch), flush=True)
+        socketio.emit('log_batch', batch, namespace="/")
+    if progress_state:
+        socketio.emit('progress_update', list(progress_state.values()), namespace="/")
+        progress_state.clear()
+
+def flush_logs_forever():
+    while True:
+        socketio.sleep(Config.LOG_FLUSH_INTERVAL)
+        try:
+            flush_logs()
+        except Exception as e:
+            print(f"Error flushing logs: {e}", flush=True)
+
+def get_size_kb(data):
+    return round(sys.getsizeof(json.dumps(data)) / 1024, 2)
+
+def encode_cursor(values):
+    """Encode the sort key of the last row as an opaque page cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+def is_cursor_key(values, length):
+    """Return True if a decoded cursor is a list of length values SQLite can bind"""
+    return isinstance(values, list) and len(values) == length and all(
+        value is None or isinstance(value, (str, float))
+        or (isinstance(value, int) and -2**63 <= value < 2**63)
+        for value in values
+    )